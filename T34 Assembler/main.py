@@ -1,26 +1,236 @@
-import os, sys
-from t34Assembler import t34Assembler
+import os, sys, glob, time, argparse
+from concurrent.futures import ProcessPoolExecutor
+from t34Assembler import t34Assembler, read_module
+from t34Cache import t34Cache
+from t34Profiler import t34Profiler
+from t34Linker import t34Linker, write_image
 
-def main(path):
-    assembler = t34Assembler()
+def run(assembler, path, mode="two-pass"):
+    # Assemble the file with the two pass, streaming or one pass assembler and write its object file
+    objectPath = path[:-2] + '.o'
+
+    # Stream very large sources straight from the file to the object file
+    if mode == "stream":
+        return assembler.assemble_stream(path, objectPath)
 
     # Open t34 file
     if not assembler.fopen(path):
+        return None
+
+    # Read t34 file, the one pass assembler reads it line by line
+    if mode == "one-pass":
+        result = assembler.assemble_one_pass(assembler.file)
+    else:
+        assembler.fread()
+        result = assembler.assemble()
+    assembler.fwrite(objectPath)
+    assembler.fclose()
+    return result
+
+def open_cache(path, mode, cache):
+    # Only the two pass assembler reuses chunks, the cache of foo.t34 is kept next to it in foo.t.cache
+    if cache and mode == "two-pass":
+        return t34Cache(path[:-2] + '.cache')
+    return None
+
+def main(path, mode="two-pass", listing="stdout", cache=False, profile=None):
+    cache = open_cache(path, mode, cache)
+    profiler = t34Profiler(cprofile=not profile.endswith(".json")) if profile else None
+    assembler = t34Assembler(listing=listing, cache=cache, profiler=profiler)
+    result = run(assembler, path, mode)
+    if result == None:
         print(f"Unable to open {path}.")
         return False
-    
-    # Read t34 file
+    if cache:
+        cache.save()
+        print(f"--Cache, {cache}")
+    if profiler:
+        profiler.dump(profile)
+        print(f"--Profile written to {profile}\n{profiler}")
+    return result.status == 0
+
+def assemble_file(path, mode="two-pass", cache=False):
+    # Assemble one file in batch mode for the process pool, the listing is discarded
+    start = time.perf_counter()
+    cache = open_cache(path, mode, cache)
+    result = run(t34Assembler(batch=True, listing=None, cache=cache), path, mode)
+    if result == None:
+        return path, 0, 1, 0.0, [f"Unable to open {path}."]
+    diagnostics = [str(d) for d in result.diagnostics]
+    if cache:
+        cache.save()
+        diagnostics.append(f"Cache, {cache}")
+    return path, result.bytes, result.errors, time.perf_counter() - start, diagnostics
+
+def watch(path, mode="two-pass", listing="stdout", cache=False, interval=0.1):
+    # Reassemble whenever the source changes, keeping the assembler and its cache warm between runs
+    chunks = open_cache(path, mode, cache) or t34Cache()
+    assembler = t34Assembler(batch=True, listing=listing, cache=chunks if mode == "two-pass" else None)
+    stamps = None
+    try:
+        while True:
+            current = [modified(source) for source in assembler.getSources() or [path]]
+            if current != stamps:
+                stamps = current
+                start = time.perf_counter()
+                assembler.reset()
+                result = run(assembler, path, mode)
+                chunks.end()
+                if result == None:
+                    print(f"Unable to open {path}.")
+                else:
+                    for diagnostic in result.diagnostics:
+                        print(diagnostic)
+                    print(f"--Assembled {path}, {result.bytes} bytes, Errors: {result.errors}, {(time.perf_counter() - start) * 1000:.1f} ms")
+                    if mode == "two-pass":
+                        print(f"--Cache, {chunks}")
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        if cache:
+            chunks.save()
+    return True
+
+def modified(path):
+    # Modification time and size of a file, None once it is gone
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def find_sources(patterns):
+    # Expand files, directories and glob patterns into a list of source files
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.extend(sorted(glob.glob(os.path.join(pattern, "*.t34"))))
+        elif os.path.exists(pattern):
+            paths.append(pattern)
+        else:
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                print(f"{pattern} is not a valid path or file.")
+            paths.extend(matches)
+    return paths
+
+def build(paths, jobs=None, mode="two-pass", cache=False):
+    # Assemble every source across a process pool and print a summary per file
+    start = time.perf_counter()
+    totalBytes = 0
+    totalErrors = 0
+    print(f"{'File':<40}{'Bytes':>8}{'Errors':>8}{'Time':>10}")
+    workers = jobs or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Hand out files in chunks so small files do not pay a round trip each
+        chunksize = max(1, len(paths) // (workers * 4))
+        for path, bytes, errors, seconds, diagnostics in pool.map(assemble_file, paths, [mode] * len(paths), [cache] * len(paths), chunksize=chunksize):
+            print(f"{path:<40}{bytes:>8}{errors:>8}{seconds:>9.3f}s")
+            for diagnostic in diagnostics:
+                print(f"    {diagnostic}")
+            totalBytes += bytes
+            totalErrors += errors
+    print(f"\n--End build, {len(paths)} files, {totalBytes} bytes, Errors: {totalErrors}, Wall time: {time.perf_counter() - start:.3f}s")
+    return totalErrors == 0
+
+def module_path(path):
+    # The relocatable module of foo.t34 is kept next to it in foo.t.rel
+    return path[:-2] + '.rel'
+
+def current_module(path):
+    # Module of a source that is still up to date with every file it was assembled from, None if it has to be assembled again
+    try:
+        with open(module_path(path), "r") as file:
+            module = read_module(file)
+    except OSError:
+        return None
+    if module == None or not module.sources or any(modified(source) != (mtime, size) for source, mtime, size in module.sources):
+        return None
+    return module
+
+def assemble_module(path):
+    # Assemble one file into its relocatable module for the process pool, the listing is discarded
+    start = time.perf_counter()
+    assembler = t34Assembler(batch=True, listing=None, relocatable=True)
+    if not assembler.fopen(path):
+        return path, 0, 1, 0.0, [f"Unable to open {path}."]
     assembler.fread()
-    assembler.assemble()
-    assembler.fwrite(path[:-2] + '.o')
     assembler.fclose()
-    return True
+    result = assembler.assemble()
+    if result.errors == 0:
+        assembler.fwrite(module_path(path), "module")
+    return path, result.bytes, result.errors, time.perf_counter() - start, [str(d) for d in result.diagnostics]
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print(sys.argv[0] + " <file>")
+def link(paths, output, base=0x8000, jobs=None):
+    # Assemble the sources whose modules are out of date across a process pool, then link every module into one image
+    start = time.perf_counter()
+    modules = {path: current_module(path) for path in paths}
+    stale = [path for path in paths if modules[path] == None]
+    totalErrors = 0
+    print(f"{'Module':<40}{'Bytes':>8}{'Errors':>8}{'Time':>10}")
+    # A single changed module is assembled right here, starting workers would take longer than assembling it
+    if len(stale) > 1:
+        with ProcessPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+            results = list(pool.map(assemble_module, stale))
     else:
-        if os.path.exists(sys.argv[1]):
-            main(sys.argv[1])
-        else:
-            print(f"{sys.argv[1]} is not a valid path or file.")
+        results = [assemble_module(path) for path in stale]
+    for path, bytes, errors, seconds, diagnostics in results:
+        print(f"{path:<40}{bytes:>8}{errors:>8}{seconds:>9.3f}s")
+        for diagnostic in diagnostics:
+            print(f"    {diagnostic}")
+        totalErrors += errors
+    if totalErrors:
+        print(f"\n--End link, {len(paths)} modules, {len(stale)} assembled, Errors: {totalErrors}")
+        return False
+
+    # Modules in the order of the sources, the ones just assembled are read back from their files
+    linker = t34Linker(base)
+    for path in paths:
+        if modules[path]:
+            linker.add(modules[path])
+        elif not linker.add_file(module_path(path)):
+            print(f"Unable to read module {module_path(path)}.")
+            return False
+    result = linker.link()
+    for diagnostic in result.diagnostics:
+        print(diagnostic)
+    if result.errors == 0:
+        write_image(result.image, output)
+    print(f"\n--End link, {len(paths)} modules, {len(stale)} assembled, {result.bytes} bytes, Errors: {result.errors}, Wall time: {time.perf_counter() - start:.3f}s")
+    return result.errors == 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="T34 assembler")
+    parser.add_argument("paths", nargs="+", help="source files, directories or glob patterns")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes")
+    passes = parser.add_mutually_exclusive_group()
+    passes.add_argument("--stream", action="store_const", dest="mode", const="stream", help="stream large sources instead of reading them into memory")
+    passes.add_argument("--one-pass", action="store_const", dest="mode", const="one-pass", help="assemble in one pass, backpatching forward references")
+    parser.add_argument("--listing", default="stdout", help="file to write the listing to instead of stdout")
+    parser.add_argument("--cache", action="store_true", help="reuse unchanged chunks from the previous run, kept in a .cache file next to each source")
+    parser.add_argument("--watch", action="store_true", help="reassemble the file every time it changes until interrupted")
+    parser.add_argument("--profile", default=None, help="time the assembler and write a speedscope .json profile or cProfile statistics to this file")
+    parser.add_argument("-q", "--quiet", action="store_true", help="do not produce a listing")
+    parser.add_argument("--link", default=None, metavar="OUTPUT", help="assemble the files into relocatable modules, only the changed ones, and link them into this image")
+    parser.add_argument("--base", default="8000", help="address the linked image starts at, in hex")
+    parser.set_defaults(mode="two-pass")
+    args = parser.parse_args()
+
+    paths = find_sources(args.paths)
+    if not paths:
+        sys.exit(1)
+
+    # Linking builds modules of every file, watching keeps reassembling one file, a single file keeps the interactive listing
+    # and several are built in parallel
+    if args.link:
+        sys.exit(0 if link(paths, args.link, int(args.base.lstrip("$"), 16), args.jobs) else 1)
+    if args.watch:
+        if len(paths) != 1:
+            print("--watch takes a single file.")
+            sys.exit(1)
+        sys.exit(0 if watch(paths[0], args.mode, None if args.quiet else args.listing, args.cache) else 1)
+    if len(paths) == 1 and args.jobs == None:
+        sys.exit(0 if main(paths[0], args.mode, None if args.quiet else args.listing, args.cache, args.profile) else 1)
+    if args.profile:
+        print("--profile takes a single file.")
+        sys.exit(1)
+    sys.exit(0 if build(paths, args.jobs, args.mode, args.cache) else 1)
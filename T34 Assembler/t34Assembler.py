@@ -1,33 +1,115 @@
-import os, re
+import os, re, sys, mmap
+from array import array
+from bisect import bisect, bisect_left, bisect_right, insort
+from collections import deque
+from functools import lru_cache, reduce
+from operator import add, and_, floordiv, mul, or_, sub, xor
 
+# Addressing modes and the number of bytes an instruction takes in each of them
 ADDRESSING_MODES = {
-    "IMMEDIATE": re.compile("^\#\$[a-zA-Z0-9]{2}$"),
-    "ABSOLUTE": re.compile("^\$[a-zA-Z0-9]{4}$"),
-    "ABSOLUTEX": re.compile("^\$[a-zA-Z0-9]{4}\,X$"),
-    "ABSOLUTEY": re.compile("^\$[a-zA-Z0-9]{4}\,Y$"),
-    "ZEROPAGE": re.compile("^\$[a-zA-Z0-9]{2}$"),
-    "ZEROPAGEX": re.compile("^\$[a-zA-Z0-9]{2}\,X$"),
-    "ZEROPAGEY": re.compile("^\$[a-zA-Z0-9]{2}\,Y$"),
-    "INDIRECTX": re.compile("^\(\$[a-zA-Z0-9]{2}\,X\)$"),
-    "INDIRECTY": re.compile("^\(\$[a-zA-Z0-9]{2}\)\,Y$"),
-    "INDIRECT": re.compile("^\(\$[a-zA-Z0-9]{4}\)$"),
-    "RELATIVE": re.compile("^\$[a-zA-Z0-9]{2}$")
+    "IMPLIED": 1,
+    "ACCUMULATOR": 1,
+    "IMMEDIATE": 2,
+    "ABSOLUTE": 3,
+    "ABSOLUTEX": 3,
+    "ABSOLUTEY": 3,
+    "ZEROPAGE": 2,
+    "ZEROPAGEX": 2,
+    "ZEROPAGEY": 2,
+    "INDIRECTX": 2,
+    "INDIRECTY": 2,
+    "INDIRECT": 3,
+    "RELATIVE": 2
 }
 
+# Every operand syntax in one pattern, the name of the matching group is its form and the group holds the expression
+OPERAND_SHAPES = re.compile(
+    r"^(?:\#(?P<IMMEDIATE>.+)"
+    r"|\((?P<INDIRECTX>.+),X\)"
+    r"|\((?P<INDIRECTY>.+)\),Y"
+    r"|\((?P<INDIRECT>.+)\)"
+    r"|(?P<X>.+),X"
+    r"|(?P<Y>.+),Y"
+    r"|(?P<DIRECT>.+))$"
+)
+
+# Addressing modes of each operand form for values that fit in one byte and values that need two
+OPERAND_MODES = {
+    "IMMEDIATE": ("IMMEDIATE", None),
+    "INDIRECTX": ("INDIRECTX", None),
+    "INDIRECTY": ("INDIRECTY", None),
+    "INDIRECT": ("INDIRECT", "INDIRECT"),
+    "X": ("ZEROPAGEX", "ABSOLUTEX"),
+    "Y": ("ZEROPAGEY", "ABSOLUTEY"),
+    "DIRECT": ("ZEROPAGE", "ABSOLUTE")
+}
+
+# Tokens of an operand expression
+EXPRESSION_TOKENS = re.compile(
+    r"\$(?P<HEX>[0-9a-fA-F]+)"
+    r"|%(?P<BINARY>[01]+)"
+    r"|(?P<DECIMAL>[0-9]+)"
+    r"|(?P<SYMBOL>[a-zA-Z_][a-zA-Z0-9_]*)"
+    r"|(?P<OPERATOR>[-+*/!.&()])"
+)
+
+# Binary operators and their precedence, higher binds tighter
+EXPRESSION_OPERATORS = {
+    ".": (1, or_),
+    "!": (2, xor),
+    "&": (3, and_),
+    "+": (4, add),
+    "-": (4, sub),
+    "*": (5, mul),
+    "/": (5, floordiv)
+}
+
+# Lines that start a new chunk of the incremental cache
+CHUNK_BOUNDARY = re.compile(r"^\S*\s+ORG(?:\s|$)")
+CHUNK_LINES = 4096
+
+# Directives that pull in other lines, a source using them is not split into cached chunks
+DIRECTIVES = {"INCLUDE", "MACRO", "ENDM"}
+DIRECTIVE_LINE = re.compile(r"^\S*\s+(?:INCLUDE|MACRO)(?:\s|$)")
+
+# Includes and macro expansions nested deeper than this are reported instead of followed
+EXPANSION_DEPTH = 16
+
+# Bumped whenever the relocatable module format changes so old module files are assembled again
+MODULE_FORMAT = 1
+
+# Amounts the module or an import is moved by to find out how an operand moves with it
+RELOCATION_SHIFTS = (0x1000, 0x2345)
+
 ERROR_MESSAGES = {
     "BAD_OPCODE": "Bad instruction",
     "BAD_ADDRESS_MODE": "Bad address mode",
     "BAD_BRANCH": "Bad branch",
     "BAD_OPERAND": "Bad operand",
     "DUPLICATE_SYMBOL": "Duplicate symbol",
-    "MEMORY_FULL": "Source, object, or symbol are too large"
+    "UNDEFINED_SYMBOL": "Undefined symbol",
+    "MEMORY_FULL": "Source, object, or symbol are too large",
+    "OVERLAP": "Segment overlaps code assembled earlier",
+    "BAD_MACRO": "Bad macro",
+    "BAD_INCLUDE": "Unable to include file",
+    "BAD_RELOCATION": "Operand cannot be relocated",
+    "BAD_IMPORT": "Symbol cannot be imported",
+    "BAD_EXPORT": "Exported symbol is not defined",
+    "UNDEFINED_IMPORT": "Imported symbol is not exported by any module",
+    "DUPLICATE_EXPORT": "Symbol is exported by more than one module"
 }
 
+# Diagnostics that are reported without counting as errors
+WARNINGS = {"OVERLAP"}
+
 PSUEDO_INSTRUCTIONS = [
     "ORG",
     "CHK",
     "END",
-    "EQU"
+    "EQU",
+    "INCLUDE",
+    "IMPORT",
+    "EXPORT"
 ]
 
 OPCODES = {
@@ -249,7 +331,7 @@ OPCODES = {
         "INDIRECTY": "F1"
     },
     "SEC": {
-        "IMPLIED": "E8"
+        "IMPLIED": "38"
     },
     "SED": {
         "IMPLIED": "F8"
@@ -263,7 +345,7 @@ OPCODES = {
         "ABSOLUTE": "8D",
         "ABSOLUTEX": "9D",
         "ABSOLUTEY": "99",
-        "INDRECTX": "81",
+        "INDIRECTX": "81",
         "INDIRECTY": "91"
     },
     "STX": {
@@ -296,125 +378,924 @@ OPCODES = {
     },
 }
 
-class t34Assembler:
+def build_opcode_table(opcodes):
+    # Precompile the opcode table into integer opcodes keyed by instruction and addressing mode
+    table = {}
+    owners = {}
+    for instr, modes in opcodes.items():
+        for mode, opcode in modes.items():
+            # Catch typos in the table instead of silently never matching them
+            if mode not in ADDRESSING_MODES:
+                raise ValueError(f"Unknown addressing mode {mode} for {instr}")
+            byte = int(opcode, 16)
+            if byte in owners:
+                raise ValueError(f"Opcode {opcode} of {instr} {mode} is already used by {owners[byte]}")
+            owners[byte] = f"{instr} {mode}"
+            table[instr, mode] = byte
+    return table
+
+OPCODE_TABLE = build_opcode_table(OPCODES)
+
+class t34Expression:
+    # Operand expression compiled once into a closure that takes a symbol lookup
+    __slots__ = ("text", "evaluate", "symbols", "digits")
+
+    def __init__(self, text, evaluate, symbols, digits):
+        self.text = text
+        self.evaluate = evaluate
+        self.symbols = symbols
+        # Hex digits written for a lone hex literal, $0012 is still an absolute address
+        self.digits = digits
+
+def compile_expression(text):
+    # Compile an expression with precedence and parentheses, None if it is not valid
+    tokens = deque(EXPRESSION_TOKENS.finditer(text))
+    if sum(len(token.group(0)) for token in tokens) != len(text):
+        return None
+    symbols = []
+
+    # Nodes are (closure, None) or (None, value) once they are folded into a constant
+    def operand():
+        if not tokens:
+            raise ValueError(text)
+        token = tokens.popleft()
+        kind = token.lastgroup
+        if kind == "HEX":
+            return None, int(token.group(kind), 16)
+        if kind == "BINARY":
+            return None, int(token.group(kind), 2)
+        if kind == "DECIMAL":
+            return None, int(token.group(kind))
+        if kind == "SYMBOL":
+            name = sys.intern(token.group(kind))
+            symbols.append(name)
+            return (lambda lookup: lookup(name)), None
+        if token.group(0) == "(":
+            node = expression(1)
+            if not tokens or tokens.popleft().group(0) != ")":
+                raise ValueError(text)
+            return node
+        if token.group(0) == "-":
+            evaluate, value = operand()
+            if evaluate == None:
+                return None, -value
+            return (lambda lookup: -evaluate(lookup)), None
+        raise ValueError(text)
+
+    def expression(precedence):
+        left = operand()
+        while tokens and tokens[0].group(0) in EXPRESSION_OPERATORS:
+            tighter, operation = EXPRESSION_OPERATORS[tokens[0].group(0)]
+            if tighter < precedence:
+                break
+            tokens.popleft()
+            left = combine(operation, left, expression(tighter + 1))
+        return left
+
+    def combine(operation, left, right):
+        (first, a), (second, b) = left, right
+        if first == None and second == None:
+            return None, operation(a, b)
+        if first == None:
+            return (lambda lookup: operation(a, second(lookup))), None
+        if second == None:
+            return (lambda lookup: operation(first(lookup), b)), None
+        return (lambda lookup: operation(first(lookup), second(lookup))), None
+
+    try:
+        evaluate, value = expression(1)
+    except (ValueError, ZeroDivisionError):
+        return None
+    if tokens:
+        return None
+    if evaluate == None:
+        evaluate = lambda lookup: value
+    digits = len(text) - 1 if EXPRESSION_TOKENS.fullmatch(text) and text[0] == "$" else 0
+    return t34Expression(text, evaluate, tuple(symbols), digits)
+
+@lru_cache(maxsize=1 << 16)
+def compile_operand(operand):
+    # Split an operand into its form and compiled expression, shared by every line and pass that uses it
+    match = OPERAND_SHAPES.match(operand)
+    if not match:
+        return None
+    form = match.lastgroup
+    expression = compile_expression(match.group(form))
+
+    # (A+1)*2 is an expression in parentheses, not an indirect address
+    if expression == None and form == "INDIRECT":
+        form = "DIRECT"
+        expression = compile_expression(operand)
+    if expression == None:
+        return None
+    return form, expression
+
+# Included files parsed once per process, by path along with the modification time and size they were parsed at
+INCLUDE_CACHE = {}
+
+def parse_include(path, read_format):
+    # Text and fields of every line of an included file, comments have no fields, None if it cannot be read
+    try:
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        cached = INCLUDE_CACHE.get(path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        with open(path, "r") as file:
+            texts = file.readlines()
+    except OSError:
+        return None
+    lines = tuple((text.rstrip(), None if text.startswith("*") else read_format(text)) for text in texts)
+    INCLUDE_CACHE[path] = (stamp, lines)
+    return lines
+
+def map_lines(path):
+    # Lines of a file as memoryview slices of a read only memory map, a slice is released once the next one is asked for
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view, memoryview(view) as data:
+            find = view.find
+            start = 0
+            end = len(view)
+            while start < end:
+                stop = find(b"\n", start) + 1 or end
+                line = data[start:stop]
+                try:
+                    yield line
+                finally:
+                    line.release()
+                start = stop
+
+class t34Line:
+    # Parsed line of source shared by both passes of the assembler
+    __slots__ = ("lineNumber", "text", "label", "instr", "operand", "mode", "value", "size", "address", "pending")
+
+    def __init__(self, lineNumber, text):
+        self.lineNumber = lineNumber
+        self.text = text
+        self.label = None
+        self.instr = None
+        self.operand = None
+        self.mode = None
+        self.value = None
+        self.size = 0
+        self.address = None
+        self.pending = False
+
+class t34Fixup:
+    # Bytes emitted for a forward reference that are patched once its symbol is defined
+    __slots__ = ("address", "width", "relative", "expression", "sequence", "record", "line", "segment")
+
+    def __init__(self, line, sequence, record, segment):
+        self.address = line.address
+        self.width = line.size
+        self.relative = (line.instr, "RELATIVE") in OPCODE_TABLE
+        self.expression = line.operand
+        self.sequence = sequence
+        self.record = record
+        self.line = line
+        # Segment of the line, a branch is checked against it even when a later ORG started another
+        self.segment = segment
+
+class t34Chunk:
+    # Lines from one ORG to the next as the first pass left them, reused while the symbols they use are unchanged
+    __slots__ = ("pc", "imports", "lines", "exports", "exitPc", "origin", "diagnostics", "names", "pending", "branches", "checksums", "encoded")
+
+    def __init__(self, pc, imports, lines, exports, exitPc, origin, diagnostics):
+        self.pc = pc
+        self.imports = imports
+        self.lines = lines
+        self.exports = exports
+        self.exitPc = exitPc
+        self.origin = origin
+        self.diagnostics = diagnostics
+        self.names = tuple(name for name, value in imports)
+        # Forward references are resolved again by every second pass
+        self.pending = tuple(i for i, line in enumerate(lines) if line.mode == None and line.instr in OPCODES and line.operand)
+        self.branches = any((line.instr, "RELATIVE") in OPCODE_TABLE for line in lines)
+        self.checksums = any(line.instr == "CHK" for line in lines)
+        # Bytes of every line and the errors found encoding them, with the symbol values they depend on
+        self.encoded = None
+
+    def __getstate__(self):
+        # Lines are pickled as plain tuples, much smaller and faster to load than slotted objects
+        lines = [(line.lineNumber, line.text, line.label, line.instr, line.operand, line.mode, line.value, line.size, line.address) for line in self.lines]
+        return tuple(getattr(self, name) for name in self.__slots__ if name != "lines") + (lines,)
+
+    def __setstate__(self, state):
+        for name, value in zip((name for name in self.__slots__ if name != "lines"), state):
+            setattr(self, name, value)
+        self.lines = []
+        for lineNumber, text, label, instr, operand, mode, value, size, address in state[-1]:
+            line = t34Line(lineNumber, text)
+            line.label, line.instr, line.operand = label, instr, operand
+            line.mode, line.value, line.size, line.address = mode, value, size, address
+            self.lines.append(line)
+
+class t34Macro:
+    # Body of a macro split into fields when it is defined, expanding it only substitutes the parameters
+    __slots__ = ("name", "line", "lines")
+
+    def __init__(self, name, line):
+        self.name = name
+        self.line = line
+        # (text, label, instr, operand, parameterized) for every line up to ENDM
+        self.lines = []
+
+class t34SymbolTable(dict):
+    # Symbol values by name in the order they were defined, with an index sorted by value kept up to date as they are
+    def __init__(self, symbols=()):
+        super().__init__()
+        self.byValue = []
+        self.update(symbols)
+
+    def __setitem__(self, name, value):
+        # Names are interned so the lookups of every operand compare them by identity
+        name = sys.intern(name)
+        if name in self:
+            del self.byValue[bisect_left(self.byValue, (self[name], name))]
+        super().__setitem__(name, value)
+        insort(self.byValue, (value, name))
+
+    def update(self, symbols=(), **names):
+        for name, value in symbols.items() if isinstance(symbols, dict) else symbols:
+            self[name] = value
+        for name, value in names.items():
+            self[name] = value
+
+    def __reduce__(self):
+        return (t34SymbolTable, (list(self.items()),))
+
+    def numerical(self):
+        # (value, name) pairs in order of value, names with the same value alphabetically
+        return self.byValue
+
+    def lookup(self, value):
+        # Name of a symbol with this value, the first alphabetically, None if there is none
+        index = bisect_left(self.byValue, (value, ""))
+        if index < len(self.byValue) and self.byValue[index][0] == value:
+            return self.byValue[index][1]
+        return None
+
+class t34Diagnostic:
+    # Error or warning found while assembling, line and column count from 1
+    __slots__ = ("code", "line", "column", "message", "detail", "severity")
+
+    def __init__(self, code, line=None, column=None, detail=None):
+        self.code = code
+        self.line = line
+        self.column = column
+        self.detail = detail
+        self.message = ERROR_MESSAGES[code] if detail == None else f"{ERROR_MESSAGES[code]} : {detail}"
+        self.severity = "warning" if code in WARNINGS else "error"
+
+    def __str__(self):
+        # Same wording the interactive assembler has always printed, warnings are marked as such
+        text = ERROR_MESSAGES[self.code]
+        if self.line != None:
+            text = f"{text} in line: {self.line}"
+        if self.detail != None:
+            text = f"{text} : {self.detail}"
+        if self.severity == "warning":
+            text = f"Warning: {text}"
+        return text
+
+class t34Result:
+    # Outcome of an assembly run, status is 0 when there were no errors
+    __slots__ = ("status", "errors", "bytes", "diagnostics", "image", "symbols", "listing")
+
+    def __init__(self, errors, bytes, diagnostics, image=None, symbols=None, listing=None):
+        self.status = 0 if errors == 0 else 1
+        self.errors = errors
+        self.bytes = bytes
+        self.diagnostics = diagnostics
+        self.image = image
+        self.symbols = symbols
+        self.listing = listing
+
+class t34Intervals:
+    # Sorted address ranges that do not touch, ranges that overlap or adjoin are merged as they are added
+    __slots__ = ("starts", "ends", "last")
+
     def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.last = -1
+
+    def add(self, start, end):
+        # Add [start, end), returns the first part of it that was already covered or None
+        starts, ends, last = self.starts, self.ends, self.last
+        if start >= end:
+            return None
+
+        # Code is mostly emitted in address order, right after the range added last
+        if last >= 0 and ends[last] == start and (last + 1 == len(starts) or starts[last + 1] > end):
+            ends[last] = end
+            return None
+
+        # Ranges before index start at or before this one, only the one just before and those it reaches can meet it
+        index = bisect_right(starts, start)
+        low = high = index
+        overlap = None
+        if index and ends[index - 1] >= start:
+            low = index - 1
+            if ends[low] > start:
+                overlap = (start, min(end, ends[low]))
+        while high < len(starts) and starts[high] <= end:
+            if overlap == None and starts[high] < end:
+                overlap = (starts[high], min(end, ends[high]))
+            high += 1
+        if low < high:
+            start = min(start, starts[low])
+            end = max(end, ends[high - 1])
+        starts[low:high] = [start]
+        ends[low:high] = [end]
+        self.last = low
+        return overlap
+
+    def remove(self, start, end):
+        # Take [start, end) out of the ranges, a range it falls inside of is split in two
+        starts, ends = self.starts, self.ends
+        low = high = max(0, bisect_right(starts, start) - 1)
+        keptStarts, keptEnds = [], []
+        while high < len(starts) and starts[high] < end:
+            if starts[high] < start:
+                keptStarts.append(starts[high])
+                keptEnds.append(min(ends[high], start))
+            if ends[high] > end:
+                keptStarts.append(max(starts[high], end))
+                keptEnds.append(ends[high])
+            high += 1
+        starts[low:high] = keptStarts
+        ends[low:high] = keptEnds
+        self.last = -1
+
+    def overlapping(self, start, end):
+        # Ranges that share an address with [start, end) in order
+        index = max(0, bisect_right(self.starts, start) - 1)
+        while index < len(self.starts) and self.starts[index] < end:
+            if self.ends[index] > start:
+                yield self.starts[index], self.ends[index]
+            index += 1
+
+    def __iter__(self):
+        return zip(self.starts, self.ends)
+
+    def __len__(self):
+        return len(self.starts)
+
+class t34Image:
+    # 64 KiB memory image along with the records and address ranges emitted into it
+    def __init__(self):
+        self.memory = bytearray(0x10000)
+        self.records = []
+        self.used = t34Intervals()
+        self.checksum = 0
+        self.bytes = 0
+        self.stream = None
+        self.sequence = 0
+        self.checksumSequences = []
+        self.checksumAddresses = []
+        self.checksumOffsets = []
+        # Bytes of every record as it was emitted and where each record starts in them
+        # Records are written from these, later code assembled over the same addresses does not change them
+        self.recorded = bytearray()
+        self.offsets = array("I")
+        # Records saved by since() or replayed, their text is kept with them
+        self.saved = []
+        # Used ranges under every placeholder by record, what is in them is put back if it is never patched
+        self.placeholders = {}
+        # Later records emitted over a placeholder or a checksum that may still change, by record and by address
+        self.watched = {}
+        self.watchedAt = {}
+
+    def emit(self, address, data, checksum=False):
+        # Copy the bytes into memory and extend the used range they continue
+        end = address + len(data)
+        self.memory[address:end] = data
+        self.bytes += len(data)
+        self.sequence += 1
+        for byte in data:
+            self.checksum ^= byte
+        if checksum:
+            self.checksumSequences.append(self.sequence)
+            self.checksumAddresses.append(address)
+            self.checksumOffsets.append(len(self.recorded))
+
+        # Streamed records go straight to the object file instead of being kept
+        if self.stream:
+            self.stream.write(self.__record_text(address, data, checksum))
+        else:
+            self.records.append((address, len(data), checksum))
+            self.offsets.append(len(self.recorded))
+            self.recorded += data
+            if checksum and self.placeholders:
+                self.__watch(len(self.records) - 1)
+        if self.used.add(address, end) and self.watchedAt:
+            self.__cover(len(self.records) - 1, address, end)
+
+    def reserve(self, address, size):
+        # Emit zeros in place of bytes that are patched later, the record of the placeholder is returned
+        end = address + size
+        covered = [(max(start, address), min(stop, end)) for start, stop in self.used.overlapping(address, end)]
+        self.emit(address, bytes(size))
+        record = len(self.records) - 1
+        self.placeholders[record] = covered
+        self.__watch(record)
+        return record
+
+    def __watch(self, record):
+        self.watched[record] = []
+        self.watchedAt.setdefault(self.records[record][0], []).append(record)
+
+    def __cover(self, record, address, end):
+        # Note the record on the watched ones it was emitted over, none of them is more than 3 bytes long
+        for start in range(address - 2, end):
+            for watched in self.watchedAt.get(start, ()):
+                if watched != record and start + self.records[watched][1] > address:
+                    self.watched[watched].append(record)
+
+    def __settled(self, record):
+        # A placeholder was patched or dropped and is no longer watched, nothing is once none are left
+        del self.placeholders[record]
+        del self.watched[record]
+        self.watchedAt[self.records[record][0]].remove(record)
+        if not self.placeholders:
+            self.watched.clear()
+            self.watchedAt.clear()
+
+    def patch(self, record, data, sequence):
+        # Replace the bytes of a placeholder, the first checksum emitted after them absorbs the change
+        # Memory is only written where no later record was emitted over the placeholder
+        address = self.records[record][0]
+        offset = self.offsets[record]
+        delta = reduce(xor, self.recorded[offset:offset + len(data)], reduce(xor, data, 0))
+        self.recorded[offset:offset + len(data)] = data
+        for start, end in self.__uncovered(record, address, address + len(data)):
+            self.memory[start:end] = data[start - address:end - address]
+        index = bisect(self.checksumSequences, sequence)
+        if index < len(self.checksumSequences):
+            # Records are numbered one behind the sequence they were emitted at
+            address = self.checksumAddresses[index]
+            if self.__uncovered(self.checksumSequences[index] - 1, address, address + 1):
+                self.memory[address] ^= delta
+            self.recorded[self.checksumOffsets[index]] ^= delta
+        else:
+            self.checksum ^= delta
+        self.__settled(record)
+
+    def discard(self, record):
+        # Drop a placeholder that could not be patched, what the records before it left in its addresses is put back
+        address, size, checksum = self.records[record]
+        self.bytes -= size
+        covered = self.placeholders[record]
+        uncovered = self.__uncovered(record, address, address + size)
+        self.__settled(record)
+        self.records[record] = None
+        for start, end in uncovered:
+            missing = [(start, end)]
+            for low, high in covered:
+                missing = self.__without(missing, low, high)
+            for low, high in missing:
+                self.memory[low:high] = bytes(high - low)
+                self.used.remove(low, high)
+            for part in covered:
+                self.__restore(record, max(part[0], start), min(part[1], end))
+
+    def __restore(self, record, start, end):
+        # Write [start, end) back from the bytes the latest records before this one emitted there, patched ones included
+        # Addresses none of them is still emitted at are unused again
+        missing = [(start, end)] if start < end else []
+        index = record
+        while missing and index:
+            index -= 1
+            earlier = self.records[index]
+            if not earlier:
+                continue
+            low, high = earlier[0], earlier[0] + earlier[1]
+            offset = self.offsets[index]
+            for part in missing:
+                part = (max(part[0], low), min(part[1], high))
+                if part[0] < part[1]:
+                    self.memory[part[0]:part[1]] = self.recorded[offset + part[0] - low:offset + part[1] - low]
+            missing = self.__without(missing, low, high)
+        for low, high in missing:
+            self.memory[low:high] = bytes(high - low)
+            self.used.remove(low, high)
+
+    def __uncovered(self, record, start, end):
+        # Parts of [start, end) of a watched record that no record emitted after it was written over
+        parts = [(start, end)]
+        for later in self.watched.get(record, ()):
+            later = self.records[later]
+            if later:
+                parts = self.__without(parts, later[0], later[0] + later[1])
+        return parts
+
+    def emitted(self, record):
+        # Bytes of a record as it was emitted or last patched, None once it was dropped
+        if self.records[record] == None:
+            return None
+        offset = self.offsets[record]
+        return bytes(self.recorded[offset:offset + self.records[record][1]])
+
+    def __without(self, parts, low, high):
+        return [(start, end) for part in parts for start, end in ((part[0], min(part[1], low)), (max(part[0], high), part[1])) if start < end]
+
+    def mark(self):
+        # Position in the output, everything emitted after it can be saved and replayed
+        return len(self.records), self.bytes, self.checksum, len(self.checksumSequences), self.sequence, len(self.recorded)
+
+    def since(self, mark):
+        # Everything emitted after the mark, memory is saved once per contiguous range
+        records = self.records[mark[0]:]
+        ranges = []
+        for address, size, checksum in records:
+            if ranges and ranges[-1][1] == address:
+                ranges[-1] = (ranges[-1][0], address + size)
+            else:
+                ranges.append((address, address + size))
+        segments = [(start, bytes(self.memory[start:end])) for start, end in ranges]
+        checksums = list(zip((sequence - mark[4] for sequence in self.checksumSequences[mark[3]:]), self.checksumAddresses[mark[3]:],
+                             (offset - mark[5] for offset in self.checksumOffsets[mark[3]:])))
+        emitted = [records, segments, self.bytes - mark[1], self.checksum ^ mark[2], checksums, bytes(self.recorded[mark[5]:]), None]
+        self.saved.append((mark[0], emitted))
+        return emitted
+
+    def replay(self, emitted):
+        # Emit everything saved by since() again without going through emit() a record at a time
+        records, segments, count, checksum, checksums, recorded, text = emitted
+        self.saved.append((len(self.records), emitted))
+        offset = len(self.recorded)
+        for sequence, address, start in checksums:
+            self.checksumSequences.append(self.sequence + sequence)
+            self.checksumAddresses.append(address)
+            self.checksumOffsets.append(offset + start)
+        for record in records:
+            self.offsets.append(offset)
+            offset += record[1]
+        self.recorded += recorded
+        for start, data in segments:
+            end = start + len(data)
+            self.memory[start:end] = data
+            self.used.add(start, end)
+        self.records.extend(records)
+        self.sequence += len(records)
+        self.bytes += count
+        self.checksum ^= checksum
+
+    def range_checksum(self, start, end):
+        # XOR of every used byte in the address range, unused memory is zero and is skipped
+        view = memoryview(self.memory)
+        checksum = 0
+        for low, high in self.used.overlapping(start, end):
+            checksum = reduce(xor, view[max(low, start):min(high, end)], checksum)
+        return checksum
+
+    def ranges(self):
+        # Used ranges in address order, the interval index keeps them merged
+        return list(self.used)
+
+    def __record_text(self, address, data, checksum):
+        # Text format of one record, checksums are written without padding
+        if checksum:
+            return f"{address:X}: {data[0]:X}\n"
+        return f"{address:X}: {data.hex(' ').upper()}\n"
+
+    def __texts(self, start, end):
+        # Text of the records in [start, end) from their bytes as they were emitted
+        records, offsets, recorded = self.records, self.offsets, self.recorded
+        for index in range(start, end):
+            record = records[index]
+            if record:
+                offset = offsets[index]
+                yield self.__record_text(record[0], recorded[offset:offset + record[1]], record[2])
+
+    def __pieces(self):
+        # Text of every record in order, records replayed from a chunk share the text formatted the first time
+        position = 0
+        for start, emitted in self.saved:
+            yield from self.__texts(position, start)
+            if emitted[6] == None:
+                emitted[6] = "".join(self.__texts(start, start + len(emitted[0])))
+            yield emitted[6]
+            position = start + len(emitted[0])
+        yield from self.__texts(position, len(self.records))
+
+    def text(self):
+        # Object code in the text format, one record per line
+        return "".join(self.__pieces())
+
+    def write_text(self, file):
+        # Records are written as they are formatted instead of joined into one string first
+        file.writelines(self.__pieces())
+
+    def write_binary(self, file):
+        # Raw image from the lowest to the highest used address, unused gaps are zero
+        # Only the used ranges are written, a seekable file leaves the gaps as holes that read back as zero
+        ranges = self.ranges()
+        if not ranges:
+            return
+        view = memoryview(self.memory)
+        base = ranges[0][0]
+
+        # A file on disk opened for reading too is sized to the used span and mapped, the ranges are copied straight into it
+        if self.__mappable(file):
+            file.flush()
+            offset = file.tell()
+            size = ranges[-1][1] - base
+            os.ftruncate(file.fileno(), offset + size)
+            # Maps start on an allocation boundary, the part of the file before the image is mapped along with it
+            skip = offset % mmap.ALLOCATIONGRANULARITY
+            with mmap.mmap(file.fileno(), skip + size, offset=offset - skip) as output:
+                for start, end in ranges:
+                    output[skip + start - base:skip + end - base] = view[start:end]
+            file.seek(offset + size)
+            return
+
+        seekable = file.seekable()
+        offset = file.tell() if seekable else 0
+        position = base
+        for start, end in ranges:
+            if start > position:
+                if seekable:
+                    file.seek(offset + start - base)
+                else:
+                    file.write(bytes(start - position))
+            file.write(view[start:end])
+            position = end
+
+    def __mappable(self, file):
+        # Memory maps need a real file that can be read as well as written
+        try:
+            file.fileno()
+        except (AttributeError, OSError):
+            return False
+        return file.seekable() and file.readable() and file.writable()
+
+    def write_intel_hex(self, file):
+        # Intel HEX data records of up to 16 bytes for every used range
+        view = memoryview(self.memory)
+        lines = []
+        for start, end in self.ranges():
+            for address in range(start, end, 16):
+                record = bytes((min(16, end - address), address >> 8, address & 0xFF, 0)) + view[address:min(address + 16, end)]
+                lines.append(f":{record.hex().upper()}{-sum(record) & 0xFF:02X}\n")
+        lines.append(":00000001FF\n")
+        file.write("".join(lines))
+
+class t34Listing:
+    # Buffered listing sink, text is written to the file in large chunks or kept in memory without one
+    def __init__(self, file=None, owned=False, chunk=1 << 16):
+        self.file = file
+        self.owned = owned
+        self.chunk = chunk
+        self.parts = []
+        self.size = 0
+
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.file and self.size >= self.chunk:
+            self.flush()
+
+    def flush(self):
+        if self.file and self.parts:
+            self.file.write("".join(self.parts))
+            self.file.flush()
+            self.parts = []
+            self.size = 0
+
+    def getvalue(self):
+        return "".join(self.parts) if not self.file else None
+
+    def close(self):
+        self.flush()
+        if self.owned:
+            self.file.close()
+
+def open_listing(listing):
+    # None for no listing, "stdout", "memory", a path or an open file
+    if listing == None:
+        return None
+    if listing == "stdout":
+        return t34Listing(sys.stdout)
+    if listing == "memory":
+        return t34Listing()
+    if isinstance(listing, str):
+        return t34Listing(open(listing, "w"), True)
+    return t34Listing(listing)
+
+class t34Module:
+    # Relocatable object code assembled at address 0, the linker adds an address to the word at every relocation
+    __slots__ = ("name", "size", "memory", "records", "exports", "imports", "relocations", "sources")
+
+    def __init__(self, name, size=0, memory=b""):
+        self.name = name
+        self.size = size
+        self.memory = memory
+        # (offset, size, checksum) in the order the code was emitted, checksums are computed again once it is linked
+        self.records = []
+        # Exports by name as (value, relocated), relocated values are offsets into the module
+        self.exports = {}
+        self.imports = []
+        # (offset, import) of words that hold an offset into the module, or an offset from an import when it is named
+        self.relocations = []
+        # (path, modification time, size) of every file the module was assembled from
+        self.sources = []
+
+    def write_text(self, file):
+        # One directive per line followed by the records, offsets and values are hex
+        lines = [f"MODULE {MODULE_FORMAT} {self.size:X} {self.name}"]
+        lines.extend(f"SOURCE {modified} {size} {path}" for path, modified, size in self.sources)
+        lines.extend(f"IMPORT {name}" for name in self.imports)
+        lines.extend(f"EXPORT {name} {value:X} {'R' if relocated else 'A'}" for name, (value, relocated) in self.exports.items())
+        lines.extend(f"RELOC {offset:X} {name}".rstrip() if name else f"RELOC {offset:X}" for offset, name in self.relocations)
+        for offset, size, checksum in self.records:
+            if checksum:
+                lines.append(f"CHK {offset:X}")
+            else:
+                lines.append(f"{offset:X}: {self.memory[offset:offset + size].hex(' ').upper()}")
+        file.write("\n".join(lines) + "\n")
+
+def read_module(file):
+    # Module written by t34Module.write_text, None if the file is not one or was written in another format
+    module = None
+    for text in file:
+        fields = text.split()
+        if not fields:
+            continue
+        kind = fields[0]
+        if module == None:
+            if kind != "MODULE" or len(fields) < 3 or fields[1] != str(MODULE_FORMAT):
+                return None
+            module = t34Module(text.split(None, 3)[3].rstrip() if len(fields) > 3 else "", int(fields[2], 16))
+            memory = bytearray(module.size)
+        elif kind == "SOURCE":
+            modified, size, path = text.split(None, 3)[1:]
+            module.sources.append((path.rstrip("\n"), int(modified), int(size)))
+        elif kind == "IMPORT":
+            module.imports.append(fields[1])
+        elif kind == "EXPORT":
+            module.exports[fields[1]] = (int(fields[2], 16), fields[3] == "R")
+        elif kind == "RELOC":
+            module.relocations.append((int(fields[1], 16), fields[2] if len(fields) > 2 else None))
+        elif kind == "CHK":
+            module.records.append((int(fields[1], 16), 1, True))
+        else:
+            offset = int(kind[:-1], 16)
+            data = bytes.fromhex("".join(fields[1:]))
+            memory[offset:offset + len(data)] = data
+            module.records.append((offset, len(data), False))
+    if module != None:
+        module.memory = bytes(memory)
+    return module
+
+OBJECT_WRITERS = {
+    "text": (t34Image.write_text, "w"),
+    "bin": (t34Image.write_binary, "w+b"),
+    "hex": (t34Image.write_intel_hex, "w"),
+    "module": (t34Module.write_text, "w")
+}
+
+class t34Assembler:
+    def __init__(self, batch=False, listing="stdout", cache=None, profiler=None, relocatable=False):
+        self.batch = batch
+        self.listingSink = listing
+        self.cache = cache
         self.file = None
+        # Relocatable modules are assembled at address 0 and record what the linker has to adjust, see t34Module
+        self.relocatable = relocatable
+        self.reset()
+
+        # Timers are only wrapped around the methods of a profiled instance, others run at full speed
+        self.profiler = profiler
+        if profiler:
+            profiler.attach(self)
+
+    def reset(self):
+        # Clear everything from a previous run so the instance can be reused
+        self.diagnostics = []
+        self.listing = None
+        self.sources = []
         self.source = ""
-        self.code = ""
+        self.image = t34Image()
         self.commentField = ""
-        self.symbols = {}
-        self.addrTable = {}
-        self.startAddress = hex(0x8000).upper()
-        self.endAddress = 0
+        self.symbols = t34SymbolTable()
+        self.lines = []
+        self.fixups = None
+        self.chunks = None
+        self.constants = {}
+        self.macros = {}
+        self.macro = None
+        self.expansions = 0
+        # Instructions that are handled before the first pass, the directives and every macro defined so far
+        self.directives = set(DIRECTIVES)
+        self.imports = {}
+        self.exports = {}
+        self.relocatables = set()
+        self.relocations = []
+        self.module = None
+        self.startAddress = 0 if self.relocatable else 0x8000
         self.zeropage = range(0x0000, 0x00FF)
         self.errors = 0
         self.bytes = 0
         self.pc = self.startAddress
 
-    def __hex_twos_dec(self, hex):
-        # Get decimal value of hex interpreted as twos complement
-        b = bin(int(hex,16))
-        binStr = str(b)
-        twosBin = "0b"
-        for bit in binStr[2:]: twosBin += (str(int(not int(bit))))
-        return -int(twosBin, 2) + 1
-
-    def __twos_hex(self, val, nbits):
-        return hex((val + (1 << nbits)) % (1 << nbits))
+        # Every ORG starts a segment [start, end, line of the ORG], code before the first ORG is in the default one
+        self.segment = [self.startAddress, self.startAddress, None]
+        self.segments = [self.segment]
+        self.segmentIndex = 0
 
     def __inc_pc(self, amount):
-        self.pc = hex(int(self.pc, 16) + amount).upper()
+        self.pc += amount
 
     def __reset_pc(self):
-        self.pc = self.startAddress.upper()
+        self.pc = self.startAddress
 
     def __number_format(self, nstr):
-        # Convert from supported number formats to generalized hex
+        # Convert from supported number formats to an integer
         try:
             # Binary
             if nstr[0] == '%':
-                return hex(int(nstr[1:], 2)).upper()
+                return int(nstr[1:], 2)
             # Octal
             elif nstr[0] == "O":
-                return hex(int(nstr[1:], 8)).upper()
+                return int(nstr[1:], 8)
             # String operations not supported currently (too many changes to make)
             elif nstr[0] == '"':
-                print("This assembler currently does not support string operands.")
+                if not self.batch:
+                    print("This assembler currently does not support string operands.")
                 return None
             # Decimal
             elif nstr.isnumeric():
-                return hex(int(nstr)).upper()
+                return int(nstr)
             # Hexadecimal
             elif nstr.startswith("0x") or nstr.startswith("0X") or nstr[0] == "$":
-                return hex(int(nstr.replace('$', "0x"), 16)).upper()
+                return int(nstr.replace('$', "0x"), 16)
         except:
             return None
         return None
 
-    def __string_format(self, hstr):
-        # Replace a hex string with proper format for handling
-        st = hstr.upper().replace("0X", "$")
-        if len(st) == 2:
-            st = st[:1] + "0" + st[1:]
-        return st
-
-    def __extract_address(self, instr, operand, lineNumber):
-        r = re.compile("\$[a-zA-Z0-9]{1,4}")
-        operand = self.__replace_symbols(operand)
-        match = r.search(operand)
-        span = match.span()
-        addr = operand[span[0]+1:span[1]]
+    def __extract_address(self, line):
+        addr = line.value
 
         # If there is a branch instruction
-        if instr.startswith("B"):
-            # Get the twos complement hex and get proper position of branch
-            twosComp = self.__twos_hex(int(addr, 16) - int(self.addrTable[lineNumber+1],16), 8)
-            addr = twosComp.upper().replace("0X", "")
-            twosDec = self.__hex_twos_dec(addr)
-            dest = hex(int(self.addrTable[lineNumber],16) + twosDec)
-
-            # Check if position is in range of start and end addresses of the program
-            if int(dest, 16) not in range(int(self.startAddress, 16), int(self.endAddress, 16)):
-                print(f"{ERROR_MESSAGES['BAD_BRANCH']} in line: {lineNumber} : {addr}")
-                input()
-                self.errors += 1
-                return ""
+        if line.mode == "RELATIVE":
+            # Get the offset of the destination from the instruction following the branch
+            offset = addr - (line.address + line.size)
+
+            # Check if the destination is reachable and in the segment the branch is in
+            if offset not in range(-128, 128) or not self.segment[0] <= addr <= self.segment[1]:
+                self.__error("BAD_BRANCH", line, "operand", f"{offset & 0xFF:02X}")
+                return (0,)
+            return (offset & 0xFF,)
         
-        # Handle proper output for different length address
-        if len(addr) == 4:
-            addr = addr[2:] + " " + addr[:2]
-        elif len(addr) == 3:
-            addr = "0" + addr[2:] + " " + addr[:2]
-        elif len(addr) == 1:
-            addr = "0" + addr
-        return addr
+        # Absolute addresses are stored low byte first
+        if line.size == 3:
+            return (addr & 0xFF, addr >> 8)
+        return (addr,)
 
     def __get_addressing_mode(self, instruction, operand):
         # If there is no operand, addressing mode is implied or accumulator
-        if operand == None:
-            if instruction in OPCODES:
-                if "IMPLIED" in OPCODES[instruction]:
-                    return "IMPLIED"
-                elif "ACCUMULATOR" in OPCODES[instruction]:
-                    return "ACCUMULATOR"
-        
-        # If an operand exists
-        else:
-            # Operands in symbol tables are relative or zeropage addressing modes
-            if operand in self.symbols:
-                if "RELATIVE" in OPCODES[instruction]:
-                    return "RELATIVE"
-                elif "ZEROPAGE" in OPCODES[instruction]:
-                    return "ZEROPAGE"
-                else:
-                    return "ABSOLUTE"
-            
-            # Use regex to check the syntax to get proper addressing mode
-            operand = self.__replace_symbols(operand)
-            for mode in ADDRESSING_MODES.keys():
-                if ADDRESSING_MODES[mode].match(operand) and mode in OPCODES[instruction]:
-                    return mode
-        return None
+        if operand == None or operand == "A":
+            for mode in ("IMPLIED", "ACCUMULATOR"):
+                if (instruction, mode) in OPCODE_TABLE:
+                    return mode, None
+            return None, None
+
+        # Classify the operand by its form and evaluate its expression
+        compiled = compile_operand(operand)
+        if not compiled:
+            return None, None
+        form, expression = compiled
+        value = self.__do_operations(expression)
+        if value == None:
+            return None, None
+
+        # Branch instructions take their destination address as the operand
+        if (instruction, "RELATIVE") in OPCODE_TABLE:
+            if form == "DIRECT":
+                return "RELATIVE", value
+            return None, None
+
+        # Values above $FF or written with more than two hex digits need the two byte form
+        narrow, wide = OPERAND_MODES[form]
+        mode = wide if value > 0xFF or expression.digits > 2 else narrow
+
+        # So do the addresses a module is relocated by, operands without that form are reported when they are encoded
+        if self.relocatable and mode == narrow and wide and self.__relocation(expression) != (False, None):
+            mode = wide
+        if mode == None:
+            return None, None
+
+        # Zero page operands use absolute addressing when the instruction has no zero page form
+        if (instruction, mode) not in OPCODE_TABLE and mode.startswith("ZEROPAGE"):
+            mode = mode.replace("ZEROPAGE", "ABSOLUTE")
+        if (instruction, mode) not in OPCODE_TABLE:
+            return None, None
+        return mode, value
 
     def __read_format(self, line):
         # We are not handling comments
@@ -430,10 +1311,11 @@ class t34Assembler:
             if len(l) == 2:
                 operand = l[1]
 
-        # Label format
+        # Label format, an empty or whitespace only line has no fields and is read like a comment
         elif not line.startswith("*"):
             l = line.split()
-            label = l[0]
+            if l:
+                label = l[0]
             if len(l) == 3:
                 instr = l[1]
                 operand = l[2]
@@ -442,287 +1324,858 @@ class t34Assembler:
 
         return label, instr, operand
 
-    def __do_operations(self, operand):
-        supportedOperations = ['+','-','/','*','!','.','&']
-        if operand and any(x in supportedOperations for x in operand):
-            # Split the operand into pieces to do the operations
-            pieces = []
-            temp = ""
-            for c in operand:
-                if c in supportedOperations:
-                    pieces.append(temp)
-                    pieces.append(c)
-                    temp = ""
-                    continue
-                temp = temp + c
-            pieces.append(temp)
-            
-            # Iterate through the pieces of the operand 
-            for i in range(1, len(pieces), 2):
-                first = pieces[i-1]
-                second = pieces[i+1]
-                operation = pieces[i]
-
-                # Replace any known symbols with their values from symbol table
-                if first in self.symbols:
-                    first = int(self.__number_format(self.symbols[first]),16)
-                if second in self.symbols:
-                    second = int(self.__number_format(self.symbols[second]), 16)
-                
-                # Handle supported operations that exist
-                if operation == '+':
-                    operand = hex(int(first) + int(second))
-                elif operation == '-':
-                    operand = hex(int(first) - int(second))
-                elif operation == '/':
-                    operand = hex(int(first) / int(second))
-                elif operation == '*':
-                    operand = hex(int(first) * int(second))
-                elif operation == '!':
-                    operand = hex(int(first) ^ int(second))
-                elif operation == '.':
-                    operand = hex(int(first) | int(second))
-                elif operation == '&':
-                    operand = hex(int(first) & int(second))
-                operand = self.__string_format(str(operand).upper())
-                if len(operand) == 2:
-                    operand = operand[:1] + '0' + operand[1:]
-        # Return the result of the operations
-        return operand
-
-    def __replace_symbols(self, operand):
-        # Replace all symbols in the symbol table with their associated values
-        for symbol in self.symbols.keys():
-            if symbol in operand:
-                symbolRef = self.__string_format(str(self.symbols[symbol]).upper())
-                if len(symbolRef) == 2:
-                    symbolRef = symbolRef[:1] + '0' + symbolRef[1:]
-                operand = operand.replace(symbol, symbolRef)
-        return operand
+    def __do_operations(self, expression):
+        # Symbols never change once defined, so a resolved expression is only evaluated once per run
+        value = self.constants.get(expression.text)
+        if value == None:
+            try:
+                value = expression.evaluate(self.__replace_symbols)
+            except (KeyError, ZeroDivisionError):
+                # Operand references a symbol that is not defined yet
+                return None
+            self.constants[expression.text] = value
+
+        # Operands have to fit in the 16 bit address space
+        if not 0 <= value <= 0xFFFF:
+            return None
+        return value
+
+    def __replace_symbols(self, symbol):
+        # Value of a symbol from the symbol table, KeyError if it is not defined yet
+        return self.symbols[symbol]
 
     def __calc_bytes(self):
-        # Iterate through object code to count the total amount of bytes
-        for line in self.code.splitlines():
-            self.bytes = self.bytes + len(line.split()) - 1
+        # The image counts the bytes as they are emitted
+        self.bytes = self.image.bytes
 
     def __xor_previous_bytes(self):
-        checkSum = 0
-        # Iterate through the object code and get the checksum hex
-        for line in self.code.splitlines():
-            for byte in line.split()[1:]:
-                checkSum = checkSum ^ int(byte, 16)
-        return hex(checkSum).upper()
-
-    def __add_symbol(self, label, operand, lineNumber):
-        # Check for duplicate symbols in the symbol table
-        if not label in self.symbols:
-            # Get proper format and convert different base types
-            symbolValue = self.__number_format(operand)
+        # The image keeps the checksum of every byte emitted so far
+        return self.image.checksum
 
-            # Inproper use of the symbol results in bad operand
-            if symbolValue == None:
-                print(f"{ERROR_MESSAGES['BAD_OPERAND']} in line: {lineNumber}")
+    def __column(self, line, field):
+        # Column of the label, instr or operand field in the source line
+        if line.text == None:
+            return None
+        start = 0
+        for name in ("label", "instr", "operand"):
+            part = getattr(line, name)
+            if part == None:
+                continue
+            start = line.text.find(part, start)
+            if name == field:
+                return start + 1
+            start += len(part)
+        return None
+
+    def __error(self, code, line=None, field=None, detail=None):
+        # Collect the diagnostic, interactive runs also report it and wait for the user
+        lineNumber = line.lineNumber if line else None
+        column = self.__column(line, field) if line and field else None
+        self.__report(t34Diagnostic(code, lineNumber, column, detail))
+
+    def __report(self, diagnostic):
+        self.diagnostics.append(diagnostic)
+        warning = diagnostic.severity == "warning"
+        if not warning:
+            self.errors += 1
+        if not self.batch:
+            # Flush the listing first so the error shows up after the lines before it, only errors wait for the user
+            if self.listing:
+                self.listing.flush()
+            print(diagnostic)
+            if not warning:
                 input()
-                return False
 
-            # Add to symbol table
-            self.symbols[label] = symbolValue
-        
-        # Label already exists, result in duplicate symbol error
+    def __add_symbol(self, label, operand, line):
+        # Check for duplicate symbols in the symbol table
+        if label in self.symbols:
+            self.__error("DUPLICATE_SYMBOL", line, "label")
+            return
+
+        # Labels take the pc, an EQU a number or an expression of symbols defined before it
+        value = self.pc if operand == None else self.__number_format(operand)
+        compiled = None
+        if value == None:
+            compiled = compile_expression(operand)
+            value = self.__do_operations(compiled) if compiled else None
+
+        # Inproper use of the symbol results in bad operand
+        if value == None:
+            self.__error("BAD_OPERAND", line, "operand")
+            return
+
+        # Labels of a module move with it, so do symbols equated to an offset from one
+        if self.relocatable:
+            relocation = (True, None) if operand == None else self.__relocation(compiled) if compiled else (False, None)
+            if relocation == None or relocation[1] != None:
+                self.__error("BAD_RELOCATION", line, "operand")
+                return
+            if relocation[0]:
+                self.relocatables.add(label)
+
+        # Add to symbol table and patch any forward references waiting for it
+        self.symbols[label] = value
+        if self.fixups and label in self.fixups:
+            self.__resolve_fixups(label)
+
+    def __operand_size(self, line):
+        # Known addressing modes take the size listed for them
+        if line.mode:
+            return ADDRESSING_MODES[line.mode]
+        # Unresolved operands increase the pc by 2 unless the instruction only has 3 byte forms
+        # Forward references of a module are mostly labels, they take the two byte address form when there is one
+        if line.operand:
+            if all(ADDRESSING_MODES[mode] == 3 for mode in OPCODES[line.instr]):
+                return 3
+            if self.relocatable:
+                compiled = compile_operand(line.operand)
+                if compiled and OPERAND_MODES[compiled[0]][1] and (line.instr, OPERAND_MODES[compiled[0]][1]) in OPCODE_TABLE:
+                    return 3
+            return 2
+        # Default, instructions increment pc by 1
+        return 1
+
+    def __resolve(self, line):
+        # Get the addressing mode of the line, None while a symbol it references is not defined yet
+        line.mode, line.value = self.__get_addressing_mode(line.instr, line.operand)
+        return line.mode
+
+    def __first_pass(self, line):
+        # Update the symbol table and pc for a parsed line of asm, False stops assembly
+        label, instr, operand = line.label, line.instr, line.operand
+
+        # A line of nothing but whitespace is skipped like a comment
+        if label == None and instr == None:
+            return True
+
+        # If the instruction is invalid, report it and skip the line
+        if instr not in OPCODES and instr not in PSUEDO_INSTRUCTIONS and instr not in self.macros:
+            self.__error("BAD_OPCODE", line, "instr")
+            line.instr = None
+            return True
+
+        # Handle label first pass symbol creation
+        if label:
+            self.__add_symbol(label, operand if instr == "EQU" and operand else None, line)
+
+        # Modules are placed by the linker
+        if instr == "ORG" and self.relocatable:
+            self.__error("BAD_RELOCATION", line, "instr")
+            return True
+
+        # Imports are symbols at 0 until the module is linked, exports are checked once every symbol is defined
+        if instr == "IMPORT" or instr == "EXPORT":
+            for name in operand.split(",") if operand else [None]:
+                if not name:
+                    self.__error("BAD_OPERAND", line, "operand" if operand else "instr")
+                elif instr == "EXPORT":
+                    self.exports.setdefault(name, line)
+                elif not self.relocatable or name in self.symbols:
+                    self.__error("BAD_IMPORT", line, "operand", name)
+                else:
+                    self.imports[name] = line
+                    self.symbols[name] = 0
+            return True
+
+        # Handle the ORG psuedo instruction
+        if instr == "ORG":
+            origin = self.__number_format(operand) if operand else None
+            if origin == None:
+                self.__error("BAD_OPERAND", line, "operand")
+                return True
+            line.value = origin
+            self.__open_segment(line.lineNumber, origin)
+            self.startAddress = origin
+            self.pc = self.startAddress
+            line.address = self.pc
+
+        # CHK reserves a byte for the checksum, other psuedo instructions and macro invocations none
+        elif instr not in OPCODES:
+            if instr == "CHK":
+                line.size = 1
+
+        # Resolve the addressing mode now if every symbol is known for proper pc count update
         else:
-            print(f"{ERROR_MESSAGES['DUPLICATE_SYMBOL']} in line: {lineNumber}")
-            input()
-            self.errors += 1
-        
-        # Memory is full if the symbol table exceeds 255
-        if len(self.symbols) > 255:
-            print(ERROR_MESSAGES["MEMORY_FULL"])
-            input()
+            self.__resolve(line)
+            line.size = self.__operand_size(line)
+
+        # Code has to fit in the 64 KiB address space
+        if self.pc + line.size > 0x10000:
+            self.__error("MEMORY_FULL", line)
             return False
+        self.__inc_pc(line.size)
+        return True
+
+    def __assemble(self, source, path=None):
+        self.listing = open_listing(self.listingSink)
+        try:
+            return self.__assemble_passes(source, path)
+        finally:
+            if self.listing:
+                self.listing.close()
+
+    def __assemble_passes(self, source, path):
+        # Sources assembled in memory can reuse the chunks of a previous run, unless lines come from elsewhere
+        if self.cache and path == None and not self.relocatable and not self.__has_directives(source):
+            if not self.__cached_first_pass(source): return self.__result()
+        else:
+            if not self.__full_first_pass(source, path): return self.__result()
+        self.__end_first_pass()
+
+        # Streamed sources are read again, the other ones were kept whole by the first pass
+        if path == None:
+            self.__assembler_print(self.__stored_lines())
+        else:
+            self.__assembler_print(self.__streamed_lines(path))
+        return self.__result()
+
+    def __open_segment(self, lineNumber, start):
+        # An ORG ends the segment before it at the current pc and starts a new one
+        self.__close_segment()
+        self.segment = [start, start, lineNumber]
+        self.segments.append(self.segment)
+
+    def __close_segment(self):
+        # The one pass assembler patches the forward branches that waited for the segment to end
+        self.segment[1] = self.pc
+        key = ("segment", len(self.segments) - 1)
+        if self.fixups and key in self.fixups:
+            self.__resolve_fixups(key)
+
+    def __end_first_pass(self):
+        # Close the last segment, warn about segments written over others and rewind for the second pass
+        self.__close_segment()
+        self.__check_segments()
+        if self.relocatable:
+            self.__check_exports()
+        self.__reset_pc()
+        self.segmentIndex = 0
+        self.segment = self.segments[0]
+
+    def __check_exports(self):
+        # A module can only export the symbols it defines
+        for name, line in self.exports.items():
+            if name not in self.symbols or name in self.imports:
+                self.__error("BAD_EXPORT", line, "operand", name)
+
+    def __relocation(self, expression):
+        # How an operand moves when the module or an import does, (False, None) when it stays, (True, None) with the module
+        # and (True, name) with an import, None when it moves any other way
+        movable = [name for name in expression.symbols if name in self.relocatables or name in self.imports]
+        if not movable:
+            return False, None
+        try:
+            value = expression.evaluate(self.__replace_symbols)
+        except (KeyError, ZeroDivisionError):
+            return None
+        moves = []
+        for target in [None] + [name for name in dict.fromkeys(movable) if name in self.imports]:
+            moved = [self.__moved(expression, target, shift) - value for shift in RELOCATION_SHIFTS]
+            if moved == list(RELOCATION_SHIFTS):
+                moves.append(target)
+            elif any(moved):
+                return None
+        if len(moves) > 1:
+            return None
+        return (True, moves[0]) if moves else (False, None)
+
+    def __moved(self, expression, target, shift):
+        # Value of the expression with the module, or only the import named by target, moved by shift
+        symbols = self.symbols
+        if target == None:
+            moving = self.relocatables
+            return expression.evaluate(lambda name: symbols[name] + shift if name in moving else symbols[name])
+        return expression.evaluate(lambda name: symbols[name] + shift if name == target else symbols[name])
+
+    def __relocate(self, line):
+        # Record the words of a module the linker adds the address of the module or an import to
+        compiled = compile_operand(line.operand)
+        relocation = self.__relocation(compiled[1]) if compiled else (False, None)
+        if relocation == (False, None):
+            return
+        if line.mode == "RELATIVE":
+            # Branches within the module move with it
+            if relocation != (True, None):
+                self.__error("BAD_RELOCATION", line, "operand")
+        elif relocation == None or line.size != 3:
+            self.__error("BAD_RELOCATION", line, "operand")
+        else:
+            self.relocations.append((line.address + 1, relocation[1]))
+
+    def __build_module(self, name):
+        # The module of the run, code starts at offset 0 and ends at the highest address written
+        size = max((end for start, end in self.image.ranges()), default=0)
+        module = t34Module(name, size, bytes(self.image.memory[:size]))
+        module.records = [record for record in self.image.records if record]
+        module.imports = list(self.imports)
+        module.exports = {name: (self.symbols[name], name in self.relocatables) for name in self.exports if name in self.symbols and name not in self.imports}
+        module.relocations = self.relocations
+        for path in self.sources:
+            try:
+                stat = os.stat(path)
+                module.sources.append((path, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                pass
+        return module
+
+    def __check_segments(self):
+        # Each segment is checked against the ones before it through an interval index of what they cover
+        covered = t34Intervals()
+        for start, end, lineNumber in self.segments:
+            overlap = covered.add(start, end)
+            if overlap:
+                self.__report(t34Diagnostic("OVERLAP", lineNumber, None, f"{overlap[0]:04X}-{overlap[1] - 1:04X}"))
+
+    def __full_first_pass(self, source, path):
+        # Iterate through asm source, parsing every line once into the line IR
+        for line, assemble, expanded in self.__expand(source):
+            # Get proper output for the PC and ignore comments
+            line.address = self.pc
+            if assemble:
+                if not self.__first_pass(line): return False
+
+            # Streaming parses the source again in the second pass, it only keeps the lines that cannot be parsed the same way again:
+            # forward references, segment starts, lines of macro definitions and the lines of included files and macros
+            if path == None or expanded:
+                self.lines.append(line)
+            elif line.size and line.mode == None and line.instr in OPCODES or line.instr == "ORG" \
+                    or not assemble and not line.text.startswith("*"):
+                line.text = None
+                self.lines.append(line)
+        return True
+
+    def __expand(self, source, lineNumber=0):
+        # Parse the source a line at a time, an INCLUDE or macro invocation is followed by the lines it stands for
+        # Every line comes with whether the first pass assembles it and whether it came from another file or a macro
+        directory = os.path.dirname(self.sources[0]) if self.sources else ""
+        for text in source:
+            lineNumber += 1
+            line = t34Line(lineNumber, text.rstrip())
+            if text.startswith("*"):
+                yield line, False, False
+                continue
+            line.label, line.instr, line.operand = self.__read_format(text)
+            if self.macro != None or line.instr in self.directives:
+                yield from self.__directive(line, directory, 0, False)
+            else:
+                yield line, True, False
+
+        # A macro still being defined at the end of the source is missing its ENDM
+        if self.macro != None:
+            self.__error("BAD_MACRO", self.macro.line, "label")
+            self.macro = None
+
+    def __directive(self, line, directory, depth, expanded):
+        # Define a macro, include a file or expand a macro invocation
+        instr = line.instr
+        if self.macro != None:
+            # Lines up to ENDM are the body of the macro being defined, they are only listed
+            if instr == "ENDM":
+                self.macros[self.macro.name] = self.macro
+                self.directives.add(self.macro.name)
+                self.macro = None
+            else:
+                self.macro.lines.append((line.text, line.label, instr, line.operand, "\\" in line.text))
+            yield self.__listed(line), False, expanded
+        elif instr == "MACRO":
+            name = line.label
+            if name == None or name in OPCODES or name in PSUEDO_INSTRUCTIONS or name in DIRECTIVES or name in self.macros:
+                self.__error("BAD_MACRO", line, "label" if name else "instr")
+            else:
+                self.macro = t34Macro(name, line)
+            yield self.__listed(line), False, expanded
+        elif instr == "ENDM":
+            self.__error("BAD_MACRO", line, "instr")
+            yield self.__listed(line), False, expanded
+        elif instr == "INCLUDE":
+            yield line, True, expanded
+            yield from self.__include(line, directory, depth)
+        else:
+            yield line, True, expanded
+            yield from self.__invoke(line, directory, depth)
+
+    def __listed(self, line):
+        # Lines of a macro definition are listed like comments
+        line.label = line.instr = line.operand = None
+        return line
 
+    def __include(self, line, directory, depth):
+        # Lines of an included file, parsed once per process and numbered like the INCLUDE
+        path = os.path.join(directory, line.operand) if line.operand else None
+        entries = parse_include(path, self.__read_format) if path and depth < EXPANSION_DEPTH else None
+        if entries == None:
+            self.__error("BAD_INCLUDE", line, "operand" if line.operand else "instr")
+            return
+
+        # Included files are sources of the run too, watching them reassembles it
+        if path not in self.sources:
+            self.sources.append(path)
+        directory = os.path.dirname(path)
+        for text, fields in entries:
+            included = t34Line(line.lineNumber, text)
+            if fields == None:
+                yield included, False, True
+                continue
+            included.label, included.instr, included.operand = fields
+            if self.macro != None or included.instr in self.directives:
+                yield from self.__directive(included, directory, depth + 1, True)
+            else:
+                yield included, True, True
+
+    def __invoke(self, line, directory, depth):
+        # Lines of a macro with \1 to \9 replaced by its comma separated arguments and \@ by a number unique to the expansion
+        if depth >= EXPANSION_DEPTH:
+            self.__error("BAD_MACRO", line, "instr")
+            return
+        self.expansions += 1
+        arguments = line.operand.split(",") if line.operand else []
+        number = str(self.expansions)
+        for text, label, instr, operand, parameterized in self.macros[line.instr].lines:
+            if parameterized:
+                text, label, instr, operand = (self.__substitute(field, arguments, number) for field in (text, label, instr, operand))
+            expanded = t34Line(line.lineNumber, text)
+            expanded.label, expanded.instr, expanded.operand = label, instr, operand
+            if self.macro != None or instr in self.directives:
+                yield from self.__directive(expanded, directory, depth + 1, True)
+            else:
+                yield expanded, True, True
+
+    def __substitute(self, field, arguments, number):
+        if field == None or "\\" not in field:
+            return field
+        for index, argument in enumerate(arguments[:9]):
+            field = field.replace(f"\\{index + 1}", argument)
+        return field.replace("\\@", number)
+
+    def __has_directives(self, source):
+        # Included files and macros are not part of the text a chunk is keyed by
+        return any(("INCLUDE" in text or "MACRO" in text) and DIRECTIVE_LINE.match(text) for text in source)
+
+    def __source_chunks(self, source):
+        # Split the source into chunks that start at each ORG, long runs of code are split further
+        source = source if isinstance(source, list) else list(source)
+        start = 0
+        for index, text in enumerate(source):
+            if index - start >= CHUNK_LINES or "ORG" in text and index > start and CHUNK_BOUNDARY.match(text):
+                yield source[start:index]
+                start = index
+        if start < len(source):
+            yield source[start:]
+
+    def __cached_first_pass(self, source):
+        # Reuse the first pass of every chunk whose text, pc and the symbols it uses are unchanged
+        self.chunks = []
+        self.cache.begin()
+        lineNumber = 0
+        for texts in self.__source_chunks(source):
+            key = self.cache.key("".join(texts))
+            chunk = self.cache.get(key)
+            start = len(self.lines)
+
+            # A chunk repeated in the same source is assembled again since its lines are already in use
+            if chunk and key not in self.cache.used and chunk.pc == self.pc \
+                    and all(self.symbols.get(name) == value for name, value in chunk.imports):
+                self.cache.hits += 1
+                self.cache.keep(key)
+                self.__replay_first_pass(chunk, lineNumber)
+            else:
+                self.cache.misses += 1
+                chunk = self.__chunk_first_pass(lineNumber, texts)
+                if chunk == None:
+                    return False
+                self.cache.put(key, chunk)
+            self.chunks.append((chunk, start, len(self.lines)))
+            lineNumber += len(texts)
         return True
-            
+
+    def __chunk_first_pass(self, lineNumber, texts):
+        # Run the first pass over a chunk and record what it depends on and what it defines
+        pc = self.pc
+        startAddress = self.startAddress
+        count = len(self.symbols)
+        errors = len(self.diagnostics)
+        names = {}
+        for text in texts:
+            lineNumber += 1
+            line = t34Line(lineNumber, text.rstrip())
+            line.address = self.pc
+            if not text.startswith("*"):
+                line.label, line.instr, line.operand = self.__read_format(text)
+                if not self.__first_pass(line): return None
+                for name in self.__references(line):
+                    names[name] = None
+            self.lines.append(line)
+
+        # Symbols the chunk defines were undefined when it started, the others had their current value
+        exports = [(name, self.symbols[name]) for name in list(self.symbols)[count:]]
+        defined = dict(exports)
+        imports = tuple((name, None if name in defined else self.symbols.get(name)) for name in names)
+        lines = self.lines[-len(texts):]
+        first = lines[0].lineNumber
+        diagnostics = [(d.code, d.line - first if d.line != None else None, d.column, d.detail) for d in self.diagnostics[errors:]]
+        origin = self.startAddress if self.startAddress != startAddress else None
+        return t34Chunk(pc, imports, lines, exports, self.pc, origin, diagnostics)
+
+    def __replay_first_pass(self, chunk, lineNumber):
+        # Reuse the lines and symbols of a chunk exactly as its first pass left them, the text is the same
+        lines = chunk.lines
+        first = lineNumber + 1
+        if lines[0].lineNumber != first:
+            for offset, line in enumerate(lines):
+                line.lineNumber = first + offset
+        for i in chunk.pending:
+            lines[i].mode = None
+            lines[i].value = None
+        if lines[0].instr == "ORG" and lines[0].value != None:
+            self.__open_segment(first, lines[0].value)
+        self.lines.extend(lines)
+        for code, offset, column, detail in chunk.diagnostics:
+            self.__report(t34Diagnostic(code, first + offset if offset != None else None, column, detail))
+        self.symbols.update(chunk.exports)
+        self.pc = chunk.exitPc
+        if chunk.origin != None:
+            self.startAddress = chunk.origin
+
+    def __references(self, line):
+        # Symbols a line defines or uses
+        names = [line.label] if line.label else []
+        if line.operand and line.instr in OPCODES:
+            compiled = compile_operand(line.operand)
+            if compiled:
+                names.extend(compiled[1].symbols)
+        elif line.operand and line.instr == "EQU":
+            compiled = compile_expression(line.operand)
+            if compiled:
+                names.extend(compiled.symbols)
+        return names
+
     def assemble(self):
-        # Iterate through asm source
-        for lineNumber, line in enumerate(self.source):
-            lineNumber = lineNumber + 1
-            
-            # Check if pc is out of valid memory range
-            if (int(self.pc, 16)) > 65535:
-                print(f'{ERROR_MESSAGES["MEMORY_FULL"]}')
-                input()
-                return
-            
-            # Get proper output for the PC and ignore comments
-            self.addrTable[lineNumber] = self.pc.replace("0X", "")
-            if line.startswith("*"): continue
+        result = self.__assemble(self.source)
+        if self.relocatable:
+            self.module = self.__build_module(os.path.basename(self.sources[0]) if self.sources else "")
+        return result
 
-            # If line is not a comment, read the format of the line of asm
-            label, instr, operand = self.__read_format(line)
+    def assemble_stream(self, path, objectPath=None):
+        # Assemble a file without holding its source or text object code in memory, the source is memory mapped and read twice
+        objectFile = open(objectPath, "w") if objectPath else None
+        self.image.stream = objectFile
+        self.sources.append(path)
+        try:
+            return self.__assemble(self.__read_lines(path), path)
+        finally:
+            self.image.stream = None
+            if objectFile:
+                objectFile.close()
 
-            # If the instruction is invalid return
-            if instr not in OPCODES and instr not in PSUEDO_INSTRUCTIONS:
-                print(f'{ERROR_MESSAGES["BAD_OPCODE"]} in line: {lineNumber}')
-                input()
-                return
+    def __read_lines(self, path):
+        # Generate the lines of a source file one at a time from a memory map
+        # Comments are not decoded, the first pass only needs to know they are comments and the second lists them from the map
+        for data in map_lines(path):
+            yield "*" if data[0] == 42 else str(data, "utf-8")
 
-            # Handle label first pass symbol creation
-            if label:
-                if instr == "EQU" and operand:
-                    if not self.__add_symbol(label, operand, lineNumber): return
-                else:
-                    if not self.__add_symbol(label, self.pc, lineNumber): return
-
-                    # Jump instructions increase pc by 3
-                    if instr.startswith("J"):
-                        self.__inc_pc(3)
-                    else:
-                        # Get addressing mode for proper pc count update
-                        mode = self.__get_addressing_mode(instr, operand)
-                        if mode and mode.startswith("ABSOLUTE") or mode == "INDIRECT":
-                            self.__inc_pc(3)
-                        else:
-                            # Operands increase the pc by 2
-                            if operand:
-                                self.__inc_pc(2)
-                            # Default, instructions increment pc by 1
-                            else:
-                                self.__inc_pc(1)
-            # Handle non-labels
+    def __stored_lines(self):
+        yield from self.lines
+
+    def __streamed_lines(self, path):
+        # Pair the lines kept by the first pass back up with the source as it is read again, the others are parsed again
+        # Without a listing, comments and the lines that were kept are not decoded at all
+        stored = iter(self.lines)
+        pending = next(stored, None)
+        listing = self.listing
+        pc = self.segments[0][0]
+        for lineNumber, data in enumerate(map_lines(path), 1):
+            if pending and pending.lineNumber == lineNumber and pending.text == None:
+                line = pending
+                pending = next(stored, None)
+                if listing:
+                    line.text = str(data, "utf-8").rstrip()
+                pc = line.address + line.size
+            elif data[0] == 42:
+                if not listing:
+                    continue
+                line = t34Line(lineNumber, str(data, "utf-8").rstrip())
             else:
-                # Handle the ORG psuedo instruction
-                if instr == "ORG":
-                    self.startAddress = self.__number_format(operand)
-                    if self.startAddress == None:
-                        print(f"{ERROR_MESSAGES['BAD_OPERAND']} in line: {lineNumber}")
-                        input()
-                        return
-                    self.pc = self.startAddress
-
-                # Same checks as labels with non-labels for pc count
-                elif instr.startswith("J"):
-                    self.__inc_pc(3)
-                else:
-                    mode = self.__get_addressing_mode(instr, operand)
-                    if mode and mode.startswith("ABSOLUTE") or mode == "INDIRECT":
-                        self.__inc_pc(3)
-                    else:
-                        if operand:
-                            self.__inc_pc(2)
-                        else:
-                            self.__inc_pc(1)
-        self.endAddress = self.pc
-        self.__reset_pc()
-        self.__assembler_print()
+                # The symbols a line uses were defined when the first pass resolved it, it resolves the same way again
+                text = str(data, "utf-8")
+                line = t34Line(lineNumber, text.rstrip())
+                line.label, line.instr, line.operand = self.__read_format(text)
+                line.address = pc
+                if line.instr in OPCODES and self.__resolve(line):
+                    line.size = ADDRESSING_MODES[line.mode]
+                elif line.instr == "CHK":
+                    line.size = 1
+                pc += line.size
+            yield line
+
+            # Lines from included files and macros keep their text and follow the line they came from
+            while pending and pending.lineNumber == lineNumber:
+                pc = pending.address + pending.size
+                yield pending
+                pending = next(stored, None)
 
-    def __assembler_print(self):
-        print("Assembling")
+    def __encode(self, line):
+        # Forward references are resolved now that the symbol table is complete
+        mode = line.mode
+        if mode == None:
+            mode = self.__resolve(line)
 
-        # Enumerate lines of the source asm
-        for lineNumber, line in enumerate(self.source):
-            lineNumber = lineNumber + 1
+            # A forward reference has to fit the space reserved for it by the first pass
+            if mode and ADDRESSING_MODES[mode] > line.size:
+                mode = mode.replace("ABSOLUTE", "ZEROPAGE")
+                if line.value > 0xFF or (line.instr, mode) not in OPCODE_TABLE:
+                    mode = None
+                line.mode = mode
 
-            # Ignore lines starting with comments from source asm
-            if line.startswith("*"):
-                print(f"{'':<24}{lineNumber:<3}{line.rstrip()}")
+            # Modules reserve the two byte form, a zero page address is written in it
+            elif mode and ADDRESSING_MODES[mode] < line.size:
+                mode = line.mode = mode.replace("ZEROPAGE", "ABSOLUTE")
+
+        # If the addressing mode does not match a supported format, bad address
+        if mode == None:
+            self.__error("BAD_ADDRESS_MODE", line, "operand" if line.operand else "instr")
+            return None
+        data = bytes((OPCODE_TABLE[line.instr, mode],))
+
+        # If an operand exists, extract the address
+        if line.value != None:
+            data = data + bytes(self.__extract_address(line))
+        return data
+
+    def __missing_symbol(self, operand):
+        # First symbol of the operand that is not defined yet
+        compiled = compile_operand(operand) if operand else None
+        if compiled:
+            for symbol in compiled[1].symbols:
+                if symbol not in self.symbols:
+                    return symbol
+        return None
+
+    def __resolve_fixups(self, label):
+        # Patch the forward references that were waiting for this symbol
+        for fixup in self.fixups.pop(label):
+            line = fixup.line
+            missing = self.__missing_symbol(line.operand)
+            if missing:
+                self.fixups.setdefault(missing, []).append(fixup)
+                continue
+            line.pending = False
+            segment, self.segment = self.segment, fixup.segment
+            data = self.__encode(line)
+            self.segment = segment
+            if data != None:
+                self.image.patch(fixup.record, data, fixup.sequence)
             else:
-                # If line is not a comment, read the format of the line
-                label, instr, operand = self.__read_format(line)
-
-                # If an operand exists, do any logical operations supported
-                if operand:
-                    operand = self.__do_operations(operand)
-
-                # If a label exists get the correct addressing mode and extract it
-                if label:
-                    if instr not in PSUEDO_INSTRUCTIONS:
-                        opcode = OPCODES[instr]
-                        mode = self.__get_addressing_mode(instr, operand)
-
-                        # If the addressing mode does not match a supported format, bad address
-                        if mode == None:
-                            print(f"{ERROR_MESSAGES['BAD_ADDRESS_MODE']} in line: {lineNumber}")
-                            print(f"{'':<24}{lineNumber:<3}{line.rstrip()}")
-                            self.errors += 1
-                            input()
-                            continue
-                        prefix = self.addrTable[lineNumber] + ": " + opcode[mode]
-
-                        # If an operand exists, extract the address
-                        if operand:
-                            prefix = prefix + " " + self.__extract_address(instr, operand, lineNumber)
-                        
-                        # Print label non psuedo instr output
-                        if lineNumber in self.addrTable:
-                            print(f"{prefix:<24}{lineNumber:<3}{line.rstrip()}")
-                        self.code = self.code + prefix + '\n'
-                    else:
-                        # Print label psuedo instr output
-                        print(f"{'':<24}{lineNumber:<3}{line.rstrip()}")
-                # Handle non-label lines
-                else:
-                    # Handle non psuedo instructions
-                    if instr not in PSUEDO_INSTRUCTIONS:
-                        opcode = OPCODES[instr]
-                        mode = self.__get_addressing_mode(instr, operand)
-                        
-                        # Repeat same checks as psuedo instructions but with different output
-                        if mode == None:
-                            print(f"{ERROR_MESSAGES['BAD_ADDRESS_MODE']} in line: {lineNumber}")
-                            print(f"{'':<24}{lineNumber:<3}{line.rstrip()}")
-                            self.errors += 1
-                            input()
-                            continue
-                        prefix = self.addrTable[lineNumber] + ": " + opcode[mode]
-
-                        if operand:
-                            prefix = prefix + " " + self.__extract_address(instr, operand, lineNumber)
-
-                        if lineNumber in self.addrTable:
-                            print(f"{prefix:<24}{lineNumber:<3}{line.rstrip()}")
-                        else:
-                            print(f"{'':<24}{lineNumber:<3}{line.rstrip()}")
-                        self.code = self.code + prefix + '\n'
-
-                    # Handle CHK psuedo instruction
-                    elif instr == "CHK":
-                        # Output the checksum at the position of the ORG instruction
-                        chkSum = self.__xor_previous_bytes().replace("0X", "")
-                        prefix = self.addrTable[lineNumber] + ": " + chkSum
-                        self.code = self.code + prefix + '\n'
-                        print(f"{prefix:<24}{lineNumber:<3}{line.rstrip()}")
-                    else:
-                        print(f"{'':<24}{lineNumber:<3}{line.rstrip()}")
+                self.image.discard(fixup.record)
+
+    def __emit_now(self, line):
+        # Encode a line as soon as it is read, forward references are emitted as placeholders
+        # The record of the bytes emitted for the line is returned, None when nothing was
+        if line.instr == "CHK":
+            self.image.emit(line.address, bytes((self.__xor_previous_bytes(),)), True)
+            return len(self.image.records) - 1
+        missing = self.__missing_symbol(line.operand) if line.mode == None else None
+
+        # The end of the segment is not known yet, forward branches are checked against it once it is
+        if missing == None and line.mode == "RELATIVE" and line.value > line.address:
+            missing = ("segment", len(self.segments) - 1)
+        if missing:
+            line.pending = True
+            record = self.image.reserve(line.address, line.size)
+            self.fixups.setdefault(missing, []).append(t34Fixup(line, self.image.sequence, record, self.segment))
+            return record
+        data = self.__encode(line)
+        if data == None:
+            return None
+        self.image.emit(line.address, data)
+        return len(self.image.records) - 1
+
+    def __list_emitted(self, line, record):
+        # List a line of the one pass assembler from the bytes it emitted, later code at the same addresses does not change them
+        self.__list_line(line, self.image.emitted(record) if record != None else None)
+
+    def assemble_one_pass(self, source=None):
+        # Assemble in a single pass over any iterable of lines, forward references are backpatched
+        self.listing = open_listing(self.listingSink)
+        try:
+            return self.__one_pass(self.source if source == None else source)
+        finally:
+            if self.listing:
+                self.listing.close()
+
+    def __one_pass(self, source):
+        self.fixups = {}
+        listing = self.listing
+        queue = deque()
+        if listing:
+            self.__list("Assembling")
+
+        for line, assemble, expanded in self.__expand(source):
+            line.address = self.pc
+            self.segment[1] = self.pc
+            record = None
+            if assemble:
+                if not self.__first_pass(line): return self.__result()
+                if line.size:
+                    record = self.__emit_now(line)
+
+            # Listing lines wait in order until every forward reference before them is patched
+            if listing:
+                queue.append((line, record))
+                while queue and not queue[0][0].pending:
+                    self.__list_emitted(*queue.popleft())
+        self.__end_first_pass()
+
+        # Forward references that were never defined, the last placeholder is dropped first so each puts back what was under it
+        undefined = []
+        for symbol, fixups in self.fixups.items():
+            for fixup in fixups:
+                fixup.line.pending = False
+                undefined.append(fixup.record)
+                self.__error("UNDEFINED_SYMBOL", fixup.line, "operand", symbol)
+        for record in sorted(undefined, reverse=True):
+            self.image.discard(record)
+        self.fixups = None
+
+        self.__calc_bytes()
+        if listing:
+            while queue:
+                self.__list_emitted(*queue.popleft())
+            self.__list(f"\n--End assembly, {self.bytes} bytes, Errors: {self.errors}")
+            self.__symbol_print()
+        return self.__result()
+
+    def __result(self):
+        listing = self.listing.getvalue() if self.listing else None
+        return t34Result(self.errors, self.bytes, self.diagnostics, self.image, self.symbols, listing)
+
+    def __list(self, text, end="\n"):
+        # Write to the listing sink like print would
+        self.listing.write(text + end)
+
+    def __assembler_print(self, lines):
+        # Without a listing sink nothing is formatted, the lines are only encoded
+        listing = self.listing
+        if listing:
+            self.__list("Assembling")
+
+        # Encode the line IR built by the first pass, a chunk at a time when it may be cached
+        if self.chunks == None:
+            for line in lines:
+                self.__print_line(line, self.__code(line))
+        else:
+            for chunk, start, end in self.chunks:
+                self.__print_chunk(chunk, self.lines[start:end])
 
         # Calculate the total bytes and output
         self.__calc_bytes()
-        print(f"\n--End assembly, {self.bytes} bytes, Errors: {self.errors}")
-        self.__symbol_print()
+        if listing:
+            self.__list(f"\n--End assembly, {self.bytes} bytes, Errors: {self.errors}")
+            self.__symbol_print()
+
+    def __code(self, line):
+        # Comments, macro invocations and psuedo instructions other than CHK do not generate code
+        instr = line.instr
+        if instr == None or instr not in OPCODES and instr != "CHK":
+            if instr == "ORG":
+                self.__enter_segment(line)
+            return None
+
+        # Output the checksum at the position of the CHK instruction
+        if instr == "CHK":
+            return bytes((self.__xor_previous_bytes(),))
+
+        # If the addressing mode does not match a supported format, bad address
+        data = self.__encode(line)
+        if self.relocatable and data != None and line.operand:
+            self.__relocate(line)
+        return data
+
+    def __enter_segment(self, line):
+        # The second pass moves on to the segment of an ORG as it reaches it, once however often the line is seen
+        if line.value != None and self.segment[2] != line.lineNumber:
+            self.segmentIndex += 1
+            self.segment = self.segments[self.segmentIndex]
+
+    def __print_line(self, line, data):
+        # Emit the bytes of a line and list it
+        if data != None:
+            self.image.emit(line.address, data, line.instr == "CHK")
+        if self.listing:
+            self.__list_line(line, data)
+
+    def __list_line(self, line, data):
+        if data == None:
+            prefix = ""
+        elif line.instr == "CHK":
+            prefix = f"{line.address:X}: {data[0]:X}"
+        else:
+            prefix = f"{line.address:X}: {data.hex(' ').upper()}"
+        self.__list(f"{prefix:<24}{line.lineNumber:<3}{line.text}")
+
+    def __print_chunk(self, chunk, lines):
+        # The bytes of a chunk only change with the symbols it uses, the segment of its branches and the checksum before it
+        if lines[0].instr == "ORG":
+            self.__enter_segment(lines[0])
+        key = tuple(self.symbols.get(name) for name in chunk.names)
+        if chunk.branches:
+            key += (self.segment[0], self.segment[1])
+        if chunk.checksums:
+            key += (self.image.checksum,)
+
+        # Replay the errors and listing of the chunk, its bytes are copied into the image at once
+        if chunk.encoded and chunk.encoded[0] == key:
+            self.cache.encodeHits += 1
+            key, codes, errors, emitted = chunk.encoded
+            if self.listing:
+                for offset, line in enumerate(lines):
+                    for code, column, detail in errors.get(offset, ()):
+                        self.__report(t34Diagnostic(code, line.lineNumber, column, detail))
+                    self.__list_line(line, codes[offset])
+            else:
+                for offset, diagnostics in errors.items():
+                    for code, column, detail in diagnostics:
+                        self.__report(t34Diagnostic(code, lines[offset].lineNumber, column, detail))
+            self.image.replay(emitted)
+            return
+
+        self.cache.encodeMisses += 1
+        mark = self.image.mark()
+        codes = []
+        errors = {}
+        for offset, line in enumerate(lines):
+            count = len(self.diagnostics)
+            data = self.__code(line)
+            codes.append(data)
+            if len(self.diagnostics) > count:
+                errors[offset] = [(d.code, d.column, d.detail) for d in self.diagnostics[count:]]
+            self.__print_line(line, data)
+        chunk.encoded = (key, codes, errors, self.image.since(mark))
 
     def __symbol_print(self):
         count = 0
         # Print alphabetical order symbol table
-        print("\nSymbol table - alphabetical order:")
+        self.__list("\nSymbol table - alphabetical order:")
         for label in sorted(self.symbols.keys()):
             if count == 3:
-                print()
+                self.__list("")
                 count = 0
-            print(f"\t{label:<20}=${self.symbols[label].replace('0X',''):<5}", end="")
+            self.__list(f"\t{label:<20}=${self.symbols[label]:<5X}", end="")
             count += 1
 
         # Print numerical order symbol table
-        print("\n\nSymbol table - numerical order:")
-        for label, value in self.symbols.items():
+        self.__list("\n\nSymbol table - numerical order:")
+        for value, label in self.symbols.numerical():
             if count == 3:
-                print()
+                self.__list("")
                 count = 0
-            print(f"\t{label:<20}=${value.replace('0X',''):<5}", end="")
+            self.__list(f"\t{label:<20}=${value:<5X}", end="")
             count += 1
     
     def fopen(self, path):
         # Open a file handle for reading to get source asm
         if os.path.exists(path):
             self.file = open(path, "r")
+            self.sources.append(path)
             return True
         return False
     
@@ -731,19 +2184,49 @@ class t34Assembler:
         self.source = self.file.readlines()
         return self.source
     
-    def fwrite(self, path):
-        # Write object code to file
-        file = open(path, "w")
-        file.write(self.code)
+    def fwrite(self, path, format="text"):
+        # Write object code to file as text records, a raw binary image, Intel HEX or the relocatable module
+        writer, mode = OBJECT_WRITERS[format]
+        file = open(path, mode)
+        writer(self.module if format == "module" else self.image, file)
         file.close()
 
     def getSymbols(self):
         return self.symbols
 
+    def getSymbol(self, address):
+        # Name of a symbol defined at this address or value, None if there is none
+        return self.symbols.lookup(address)
+
+    def getSources(self):
+        # Files read by the last run
+        return self.sources
+
     def getCode(self):
-        return self.code
+        return self.image.text()
+
+    def getModule(self):
+        # Relocatable module of the last run of a relocatable assembler
+        return self.module
+
+    def getImage(self):
+        return self.image
+
+    def getChecksum(self, start=0x0000, end=0x10000):
+        # Checksum of the assembled bytes between start and end
+        return self.image.range_checksum(start, end)
     
     def fclose(self):
         # Close the file handle of source asm
         self.file.close()
         self.file = None
+
+def assemble_source(source, onePass=False):
+    # Assemble source text or an iterable of lines in memory without touching any files
+    if isinstance(source, str):
+        source = source.splitlines(True)
+    assembler = t34Assembler(batch=True, listing="memory")
+    if onePass:
+        return assembler.assemble_one_pass(source)
+    assembler.source = source
+    return assembler.assemble()
@@ -0,0 +1,453 @@
+import os, io, sys, json, time, random, argparse, platform, tempfile, tracemalloc, subprocess
+from t34Assembler import t34Assembler, t34SymbolTable, compile_operand, OPCODES, ADDRESSING_MODES
+
+# Generated banks follow each other from BANK, a program too big for memory overlays them from the first one again
+BANK = 0x0800
+BANK_SIZE = 0x1000
+BANKS = (0x10000 - BANK) // BANK_SIZE
+
+# Bumped whenever the generated programs change so the ones saved by an older generator are written again
+GENERATOR = 2
+
+# Symbols defined at the top of every generated program, some of them with expressions
+HEADER = [
+    "* Generated T34 benchmark program",
+    "BANK     EQU  $0800",
+    "COUNT    EQU  10",
+    "MASK     EQU  %00001111",
+    "ZP0      EQU  $10",
+    "ZP1      EQU  ZP0+$10",
+    "ZP2      EQU  ZP1+COUNT*2",
+    "ZP3      EQU  $80",
+    "TAB0     EQU  $3000",
+    "TAB1     EQU  TAB0+$100",
+    "TAB2     EQU  TAB1+(COUNT+6)*16",
+    "TAB3     EQU  $4000"
+]
+
+# Operands for every addressing mode, {zp} and {tab} are replaced by a random symbol of the right size
+OPERANDS = {
+    "IMPLIED": [None],
+    "ACCUMULATOR": ["A"],
+    "IMMEDIATE": ["#${byte:02X}", "#{small}", "#MASK", "#COUNT*3", "#MASK.$30", "#{zp}+1"],
+    "ZEROPAGE": ["{zp}", "${byte:02X}", "{zp}+1", "{zp}+COUNT"],
+    "ZEROPAGEX": ["{zp},X", "${byte:02X},X", "{zp}+2,X"],
+    "ZEROPAGEY": ["{zp},Y", "${byte:02X},Y"],
+    "ABSOLUTE": ["{tab}", "${word:04X}", "{tab}+{small}", "{tab}+COUNT*4", "{tab}+(COUNT+{small})*2"],
+    "ABSOLUTEX": ["{tab},X", "{tab}+{small},X", "${word:04X},X"],
+    "ABSOLUTEY": ["{tab},Y", "{tab}+{small},Y", "${word:04X},Y"],
+    "INDIRECTX": ["({zp},X)", "({zp}+2,X)"],
+    "INDIRECTY": ["({zp}),Y", "({zp}+4),Y"],
+    "INDIRECT": ["({tab})", "({tab}+{small}*2)"]
+}
+
+# Segments assembled over each other, every record has to be written with the bytes it was emitted with
+OVERLAP = [
+    "         ORG  $8000",
+    "         LDA  #$01",
+    "         LDA  #$02",
+    "         ORG  $8002",
+    "         LDX  #$03",
+    "         CHK"
+]
+
+# Programs the assemblers once disagreed on, mostly forward references under or over other segments
+CHECKS = {
+    "overlap": OVERLAP,
+    "undefined-under-later": [
+        "         ORG  $8000",
+        "         STA  L7",
+        "         LDA  UNDEF",
+        "L7       NOP",
+        "         ORG  $8001",
+        "         LDA  #$01"
+    ],
+    "patched-under-undefined": [
+        "         ORG  $8000",
+        "         LDA  #$01",
+        "         LDA  #$01",
+        "         LDA  #$01",
+        "         NOP",
+        "         JMP  L3",
+        "         ORG  $8006",
+        "         BEQ  L4",
+        "         ORG  $8010",
+        "L3       NOP"
+    ],
+    "listed-under-later": [
+        "         ORG  $8000",
+        "         JMP  FWD",
+        "         NOP",
+        "         ORG  $8003",
+        "         LDX  #$05",
+        "FWD      RTS"
+    ],
+    "blank-lines": [
+        "         ORG  $8000",
+        "",
+        "         JMP  FWD",
+        "\t",
+        "    \t  ",
+        "FWD      RTS",
+        ""
+    ]
+}
+
+# Share of instructions that carry a label, large programs have tens of thousands of symbols
+LABEL_RATE = 0.125
+
+def instruction_forms():
+    # Every instruction and addressing mode pair in the opcode table
+    return [(instr, mode) for instr, modes in OPCODES.items() for mode in modes]
+
+def generate(lines, seed=0, rate=LABEL_RATE):
+    # Yield a valid program of about the given number of lines covering every instruction and addressing mode
+    rng = random.Random(seed)
+    forms = instruction_forms()
+    order = []
+    zeropage = [f"ZP{i}" for i in range(4)]
+    tables = [f"TAB{i}" for i in range(4)]
+    written = 0
+    sections = 0
+    labels = 0
+
+    for text in HEADER:
+        yield text
+        written += 1
+
+    while True:
+        # Every section is a bank of its own that ends with a checksum
+        base = BANK + sections % BANKS * BANK_SIZE
+        yield f"{'':<9}ORG  ${base:04X}"
+        written += 1
+        label = f"S{sections}"
+        sections += 1
+        pc = base
+        end = base + BANK_SIZE - 1
+        while pc + 3 <= end and (written < lines or sections > 1):
+            if rng.random() < 0.02:
+                yield f"* Block at ${pc:04X}"
+                written += 1
+                continue
+            if not order:
+                order = list(forms)
+                rng.shuffle(order)
+            instr, mode = order.pop()
+            if not label and rng.random() < rate:
+                label = f"L{labels}"
+                labels += 1
+            operand = operand_text(instr, mode, pc, base, lines - written, rng, zeropage, tables, sections, labels)
+            yield f"{label:<9}{instr:<5}{operand}" if operand else f"{label:<9}{instr}"
+            label = ""
+            written += 1
+            pc += ADDRESSING_MODES[mode]
+            if written >= lines and sections == 1:
+                break
+
+        # A program of more than one bank pads every bank to the same end
+        if sections > 1 or written < lines:
+            while pc < end:
+                yield f"{label:<9}NOP"
+                label = ""
+                written += 1
+                pc += 1
+        yield f"{label:<9}CHK"
+        written += 1
+        if written >= lines:
+            break
+    yield f"{'':<9}END"
+
+def operand_text(instr, mode, pc, base, remaining, rng, zeropage, tables, sections, labels):
+    # Operand for one instruction, branches and jumps get targets that are always valid
+    # Branches stay in the bank they are in, which is the segment the assembler checks them against
+    if mode == "RELATIVE":
+        low = max(base, pc + 2 - 128)
+        high = min(base + BANK_SIZE - 1, pc + 2 + 127) if remaining > 160 else pc
+        return f"BANK+${rng.randint(low, high) - BANK:X}"
+    if instr in ("JMP", "JSR") and mode == "ABSOLUTE":
+        if rng.random() < 0.25:
+            return f"S{rng.randrange(sections)}"
+        if labels and rng.random() < 0.5:
+            return f"L{rng.randrange(labels)}"
+        return f"BANK+${base + rng.randrange(BANK_SIZE) - BANK:X}"
+    form = rng.choice(OPERANDS[mode])
+    if form == None:
+        return None
+    return form.format(
+        zp=rng.choice(zeropage),
+        tab=rng.choice(tables),
+        byte=rng.randrange(0x100),
+        word=rng.randrange(0x0100, 0x10000),
+        small=rng.randrange(1, 10))
+
+def write_program(path, lines, seed=0):
+    # Stream a generated program to a file, large programs never sit in memory
+    count = 0
+    with open(path, "w") as file:
+        for text in generate(lines, seed):
+            file.write(text + "\n")
+            count += 1
+    return count
+
+def program_path(directory, lines, seed):
+    # Generated programs are reused between runs with the same size and seed
+    path = os.path.join(directory, f"bench_{lines}_{seed}_{GENERATOR}.t34")
+    if not os.path.exists(path):
+        write_program(path, lines, seed)
+    return path
+
+def best(function, repeat):
+    # Fastest of several runs, the result of the last run is returned with it
+    fastest = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        fastest = elapsed if fastest == None else min(fastest, elapsed)
+    return fastest, result
+
+def assemble_file(path, mode):
+    # End to end run of the assembler on a file without a listing
+    assembler = t34Assembler(batch=True, listing=None)
+    if mode == "stream":
+        return assembler.assemble_stream(path)
+    assembler.fopen(path)
+    if mode == "one-pass":
+        result = assembler.assemble_one_pass(assembler.file)
+    else:
+        assembler.fread()
+        result = assembler.assemble()
+    assembler.fclose()
+    return result
+
+def phases(path):
+    # Time every phase of the two pass assembler on its own
+    timings = {}
+    assembler = t34Assembler(batch=True, listing=None)
+
+    start = time.perf_counter()
+    assembler.fopen(path)
+    source = assembler.fread()
+    assembler.fclose()
+    timings["read"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    assembler._t34Assembler__full_first_pass(source, None)
+    assembler._t34Assembler__end_first_pass()
+    timings["firstPass"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    assembler._t34Assembler__assembler_print(assembler._t34Assembler__stored_lines())
+    timings["secondPass"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    assembler.image.text()
+    timings["textObject"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    assembler.image.write_binary(io.BytesIO())
+    timings["binaryObject"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    listed = t34Assembler(batch=True, listing="memory")
+    listed.source = source
+    listed.assemble()
+    timings["withListing"] = time.perf_counter() - start
+    return timings
+
+def peak_memory(path, mode):
+    # Peak memory traced while assembling, run on its own since tracing slows everything down
+    tracemalloc.start()
+    try:
+        assemble_file(path, mode)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def throughput(sizes, seed=0, repeat=3, mode=None, memory=True, directory=None):
+    # Assemble generated programs of every size and measure speed and memory
+    directory = directory or tempfile.gettempdir()
+    results = []
+    for lines in sizes:
+        path = program_path(directory, lines, seed)
+        with open(path, "r") as file:
+            sourceLines = sum(1 for text in file)
+
+        # Sources too big to hold as line objects are streamed and only run once
+        runMode = mode or ("stream" if lines > 1000000 else "two-pass")
+        seconds, result = best(lambda: assemble_file(path, runMode), repeat if lines <= 1000000 else 1)
+        entry = {
+            "lines": sourceLines,
+            "mode": runMode,
+            "seconds": seconds,
+            "linesPerSecond": sourceLines / seconds,
+            "bytes": result.bytes,
+            "bytesPerSecond": result.bytes / seconds,
+            "errors": result.errors
+        }
+        if runMode == "two-pass":
+            entry["phases"] = phases(path)
+        if memory:
+            entry["peakMemory"] = peak_memory(path, runMode)
+        results.append(entry)
+    return results
+
+def outputs(path, mode):
+    # Object code, used memory and listing of one run, the object code of a streamed run is the file it wrote
+    assembler = t34Assembler(batch=True, listing="memory")
+    if mode == "stream":
+        objectPath = path[:-2] + ".o"
+        result = assembler.assemble_stream(path, objectPath)
+        with open(objectPath, "r") as file:
+            text = file.read()
+    else:
+        assembler.fopen(path)
+        if mode == "one-pass":
+            result = assembler.assemble_one_pass(assembler.file)
+        else:
+            assembler.fread()
+            result = assembler.assemble()
+        assembler.fclose()
+        text = result.image.text()
+    image = result.image
+    return {
+        "object code": text,
+        "memory": [bytes(image.memory[start:end]) for start, end in image.ranges()],
+        "used ranges": image.ranges(),
+        "listing": result.listing
+    }
+
+def agreement(paths):
+    # Everything the two pass and one pass assemblers output against what the streaming one does
+    failures = []
+    for path in paths:
+        expected = outputs(path, "stream")
+        for mode in ("two-pass", "one-pass"):
+            try:
+                found = outputs(path, mode)
+            except Exception as error:
+                failures.append(f"{os.path.basename(path)}: {mode} raised {type(error).__name__}: {error}")
+                continue
+            failures.extend(f"{os.path.basename(path)}: {mode} {name} differs from stream" for name in expected if found[name] != expected[name])
+    return failures
+
+def check(lines, seed=0, directory=None):
+    # Run agreement() on the programs in CHECKS and on a generated program
+    directory = directory or tempfile.gettempdir()
+    paths = []
+    for name, source in CHECKS.items():
+        paths.append(os.path.join(directory, f"{name}.t34"))
+        with open(paths[-1], "w") as file:
+            file.write("\n".join(source) + "\n")
+    return agreement(paths + [program_path(directory, lines, seed)])
+
+def symbol_scaling(counts, operands=20000):
+    # Time operand resolution and symbol evaluation per operand as the symbol table grows
+    # Every table size resolves the same operand strings, each compiled and resolved once before
+    # the clock starts, so only the size of the table changes between runs
+    smallest = min(counts)
+    work = [f"SYM{(i * 7919) % smallest}+{i & 0xF}*2,X" for i in range(operands)]
+    results = []
+    for count in counts:
+        assembler = t34Assembler()
+        assembler.symbols = t34SymbolTable((f"SYM{i}", i & 0xFFFF) for i in range(count))
+        resolve = assembler._t34Assembler__get_addressing_mode
+        for operand in work:
+            resolve("LDA", operand)
+
+        start = time.perf_counter()
+        for operand in work:
+            resolve("LDA", operand)
+        resolved = time.perf_counter() - start
+
+        # Evaluate every compiled expression against the table, as the first resolution of an operand does
+        expressions = [compile_operand(operand)[1] for operand in work]
+        lookup = assembler.symbols.__getitem__
+        start = time.perf_counter()
+        for expression in expressions:
+            expression.evaluate(lookup)
+        evaluated = time.perf_counter() - start
+        results.append((count, resolved / operands * 1e6, evaluated / operands * 1e6))
+    return results
+
+def version():
+    # Commit of the assembler being measured, when it is in a git checkout
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, threshold):
+    # Report the change in time against a saved run, False when anything got slower than the threshold
+    previous = {(entry["lines"], entry["mode"]): entry for entry in baseline["results"]}
+    passed = True
+    print(f"\nAgainst {baseline.get('version')}:")
+    for entry in results:
+        old = previous.get((entry["lines"], entry["mode"]))
+        if old == None:
+            continue
+        change = entry["seconds"] / old["seconds"] - 1
+        slower = change > threshold
+        passed = passed and not slower
+        print(f"{entry['lines']:>10} {entry['mode']:>9} {change * 100:>+8.1f}%{'  REGRESSION' if slower else ''}")
+    return passed
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="T34 assembler benchmarks")
+    parser.add_argument("sizes", nargs="*", type=int, help="number of source lines of each generated program")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the program generator")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per size, the fastest is kept")
+    parser.add_argument("--mode", choices=["two-pass", "stream", "one-pass"], default=None, help="assembler to measure, sizes above 1M lines stream by default")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("--dir", default=None, help="directory for the generated programs")
+    parser.add_argument("--json", default=None, help="file to save the results to")
+    parser.add_argument("--compare", default=None, help="saved results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="slowdown that counts as a regression")
+    parser.add_argument("--generate", default=None, help="only write a program of the first size to this file")
+    parser.add_argument("--symbols", action="store_true", help="measure operand resolution against symbol table size instead")
+    parser.add_argument("--check", action="store_true", help="check that every assembler gives the same object code, memory and listing as streaming")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        failures = check((args.sizes or [10000])[0], args.seed, args.dir)
+        for failure in failures:
+            print(failure)
+        print(f"Agreement check: {'FAILED' if failures else 'OK'}")
+        return not failures
+
+    if args.generate:
+        print(f"{write_program(args.generate, (args.sizes or [1000])[0], args.seed)} lines written to {args.generate}")
+        return True
+
+    if args.symbols:
+        print(f"{'symbols':>10} {'resolve us':>12} {'evaluate us':>12}")
+        for count, resolved, evaluated in symbol_scaling(args.sizes or [10, 100, 1000, 10000, 50000]):
+            print(f"{count:>10} {resolved:>12.3f} {evaluated:>12.3f}")
+        return True
+
+    results = throughput(args.sizes or [1000, 10000, 100000], args.seed, args.repeat, args.mode, not args.no_memory, args.dir)
+    print(f"{'lines':>10} {'mode':>9} {'seconds':>9} {'lines/s':>11} {'bytes/s':>11} {'peak MiB':>9} {'errors':>7}")
+    for entry in results:
+        memory = f"{entry['peakMemory'] / (1 << 20):>9.1f}" if "peakMemory" in entry else f"{'':>9}"
+        print(f"{entry['lines']:>10} {entry['mode']:>9} {entry['seconds']:>9.3f} {entry['linesPerSecond']:>11.0f} {entry['bytesPerSecond']:>11.0f} {memory} {entry['errors']:>7}")
+        if "phases" in entry:
+            print(" " * 11 + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in entry["phases"].items()))
+
+    report = {
+        "version": version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results
+    }
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.compare:
+        with open(args.compare, "r") as file:
+            return compare(results, json.load(file), args.threshold)
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if main(sys.argv[1:]) else 1)
@@ -0,0 +1,68 @@
+import os, pickle
+from hashlib import blake2b
+
+# Bumped whenever the chunk layout changes so old cache files are ignored
+CACHE_FORMAT = 5
+
+class t34Cache:
+    # Assembled chunks of source kept on disk, keyed by the hash of their text
+    def __init__(self, path=None):
+        self.path = path
+        self.chunks = {}
+        self.begin()
+        if path and os.path.exists(path):
+            self.load()
+
+    def begin(self):
+        # Start counting a new run
+        self.used = {}
+        self.hits = 0
+        self.misses = 0
+        self.encodeHits = 0
+        self.encodeMisses = 0
+
+    def key(self, text):
+        return blake2b(text.encode(), digest_size=16).digest()
+
+    def get(self, key):
+        return self.chunks.get(key)
+
+    def put(self, key, chunk):
+        self.chunks[key] = chunk
+        self.used[key] = chunk
+
+    def keep(self, key):
+        # Chunks that are not used by a run are dropped when the cache is saved
+        self.used[key] = self.chunks[key]
+
+    def end(self):
+        # Drop the chunks the last run did not use, a cache kept warm between runs stays the size of one source
+        self.chunks = dict(self.used)
+
+    def load(self):
+        # An unreadable or outdated cache file is the same as an empty one
+        try:
+            with open(self.path, "rb") as file:
+                version, chunks = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+            return
+        if version == CACHE_FORMAT:
+            self.chunks = chunks
+
+    def save(self):
+        # Write to a temporary file first so an interrupted save leaves the old cache intact
+        if not self.path:
+            return
+        temp = self.path + ".tmp"
+        with open(temp, "wb") as file:
+            pickle.dump((CACHE_FORMAT, self.used), file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, self.path)
+        self.end()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "encodeHits": self.encodeHits, "encodeMisses": self.encodeMisses}
+
+    def __str__(self):
+        chunks = self.hits + self.misses
+        encoded = self.encodeHits + self.encodeMisses
+        return f"{self.hits} of {chunks} chunks parsed from cache, {self.encodeHits} of {encoded} encoded from cache"
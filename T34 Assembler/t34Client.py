@@ -0,0 +1,65 @@
+import os, sys, json, socket, argparse, tempfile
+
+# Only the standard library is imported so the client starts quickly, the daemon does the assembling
+
+def default_socket():
+    return os.path.join(tempfile.gettempdir(), f"t34-{os.getuid()}.sock")
+
+def request(messages, socketPath=None):
+    # Send requests to the daemon over one connection and return its responses in order
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socketPath or default_socket())
+        client.sendall(b"".join(json.dumps(message).encode() + b"\n" for message in messages))
+        with client.makefile("rb") as file:
+            return [response(file.readline()) for message in messages]
+
+def response(line):
+    # A connection closed before the reply or a reply that is not JSON is answered like a failed request
+    if not line:
+        return {"error": "The T34 daemon closed the connection without answering."}
+    try:
+        return json.loads(line)
+    except ValueError:
+        return {"error": "The T34 daemon sent a reply that is not JSON."}
+
+def assemble(source=None, path=None, onePass=False, listing=False, socketPath=None):
+    message = {"path": os.path.abspath(path)} if path else {"source": source}
+    message["onePass"] = onePass
+    message["listing"] = listing
+    return request([message], socketPath)[0]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="T34 assembler daemon client")
+    parser.add_argument("paths", nargs="+", help="source files to assemble")
+    parser.add_argument("--socket", default=None, help="path of the daemon's Unix socket")
+    parser.add_argument("--one-pass", action="store_true", help="assemble in one pass")
+    parser.add_argument("--listing", action="store_true", help="print the listing")
+    parser.add_argument("--json", action="store_true", help="print the raw responses")
+    args = parser.parse_args()
+
+    messages = [{"path": os.path.abspath(path), "onePass": args.one_pass, "listing": args.listing} for path in args.paths]
+    try:
+        responses = request(messages, args.socket)
+    except OSError as error:
+        print(f"Unable to reach the T34 daemon: {error}")
+        sys.exit(2)
+
+    # Object files are written next to the sources like main.py does
+    failed = False
+    for path, response in zip(args.paths, responses):
+        if args.json:
+            print(json.dumps(response))
+        if "error" in response:
+            print(response["error"])
+            failed = True
+            continue
+        with open(path[:-2] + '.o', "w") as file:
+            file.write(response["object"])
+        if args.listing and response["listing"]:
+            print(response["listing"], end="")
+        elif not args.json:
+            for diagnostic in response["diagnostics"]:
+                print(diagnostic["message"])
+            print(f"{path}: {response['bytes']} bytes, Errors: {response['errors']}")
+        failed = failed or response["status"] != 0
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,166 @@
+import os, json, signal, asyncio, argparse, tempfile, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from t34Assembler import t34Assembler
+from t34Cache import t34Cache
+
+# Warm chunk caches of the files each worker has assembled, the oldest is dropped past the limit
+CACHES = {}
+CACHE_FILES = 64
+
+# Longest request line read, sources are sent whole on one line
+REQUEST_LIMIT = 64 << 20
+
+# Types of the fields a request may have, every one of them is optional
+REQUEST_FIELDS = {
+    "path": str,
+    "source": str,
+    "onePass": bool,
+    "listing": bool
+}
+
+def default_socket():
+    return os.path.join(tempfile.gettempdir(), f"t34-{os.getuid()}.sock")
+
+def file_cache(path):
+    path = os.path.abspath(path)
+    if path not in CACHES:
+        if len(CACHES) >= CACHE_FILES:
+            del CACHES[next(iter(CACHES))]
+        CACHES[path] = t34Cache()
+    return CACHES[path]
+
+def warm():
+    # Compile the tables of a worker by assembling a line with every operand form
+    t34Assembler(batch=True, listing=None).assemble_one_pass([" LDA #$01\n", " LDA $0200,X\n", " LDA ($10),Y\n"])
+
+def assemble_job(request):
+    # Assemble one request in a worker process and describe the result in plain JSON types
+    for name, kind in REQUEST_FIELDS.items():
+        if request.get(name) != None and not isinstance(request[name], kind):
+            return {"error": f"{name} must be a {'string' if kind == str else 'boolean'}"}
+    onePass = request.get("onePass", False)
+    path = request.get("path")
+    listing = "memory" if request.get("listing") else None
+    cache = file_cache(path) if path != None and not onePass else None
+    assembler = t34Assembler(batch=True, listing=listing, cache=cache)
+
+    # Files are opened by the assembler so the files they include are found next to them
+    if path != None:
+        if not assembler.fopen(path):
+            return {"error": f"Unable to open {path}."}
+        source = assembler.fread()
+        assembler.fclose()
+    else:
+        source = request.get("source", "").splitlines(True)
+    if onePass:
+        result = assembler.assemble_one_pass(source)
+    else:
+        assembler.source = source
+        result = assembler.assemble()
+        # The cache of a file is kept for the life of the worker, only the chunks of its current text stay in it
+        if cache:
+            cache.end()
+
+    image = result.image
+    return {
+        "status": result.status,
+        "errors": result.errors,
+        "bytes": result.bytes,
+        "object": image.text(),
+        "ranges": [[start, image.memory[start:end].hex().upper()] for start, end in image.ranges()],
+        "symbols": dict(result.symbols),
+        "diagnostics": [{"code": d.code, "severity": d.severity, "line": d.line, "column": d.column, "message": str(d)} for d in result.diagnostics],
+        "listing": result.listing
+    }
+
+class t34Daemon:
+    # Accepts newline separated JSON requests on a Unix socket and assembles them on a process pool
+    def __init__(self, socketPath=None, workers=None):
+        self.socketPath = socketPath or default_socket()
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = None
+        self.server = None
+
+    async def __handle(self, reader, writer):
+        # Every connection can send any number of requests, each is answered in order
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    line = await reader.readuntil(b"\n")
+                except asyncio.IncompleteReadError as error:
+                    line = error.partial
+                except asyncio.LimitOverrunError as error:
+                    await self.__skip_line(reader, error.consumed)
+                    line = None
+                if line == b"":
+                    break
+                try:
+                    if line == None:
+                        raise ValueError(f"request longer than {REQUEST_LIMIT} bytes")
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("request must be a JSON object")
+                    response = await loop.run_in_executor(self.pool, assemble_job, request)
+                except BrokenProcessPool:
+                    # A worker died, replace the pool so the next request still gets answered
+                    self.pool = self.__start_pool()
+                    response = {"error": "worker process failed"}
+                except (ValueError, OSError) as error:
+                    response = {"error": str(error)}
+                except Exception as error:
+                    # Anything else a request raises is answered too, the requests behind it on the connection still are
+                    response = {"error": f"{type(error).__name__}: {error}"}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def __skip_line(self, reader, consumed):
+        # Drop an overlong request up to the end of its line, the requests after it are still read
+        while True:
+            await reader.readexactly(consumed)
+            try:
+                await reader.readuntil(b"\n")
+                return
+            except asyncio.LimitOverrunError as error:
+                consumed = error.consumed
+
+    def __start_pool(self):
+        # Forked workers would inherit open client connections and keep them from closing
+        context = multiprocessing.get_context("forkserver")
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+
+    async def serve(self):
+        # Serve until interrupted, a stale socket left by a previous daemon is replaced
+        if os.path.exists(self.socketPath):
+            os.unlink(self.socketPath)
+        self.pool = self.__start_pool()
+        loop = asyncio.get_running_loop()
+
+        # Start every worker before the first client so none of them pays for interpreter startup
+        await asyncio.gather(*(loop.run_in_executor(self.pool, warm) for i in range(self.workers)))
+        self.server = await asyncio.start_unix_server(self.__handle, path=self.socketPath, limit=REQUEST_LIMIT)
+        stop = loop.create_future()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.cancel)
+        print(f"T34 daemon listening on {self.socketPath} with {self.workers} workers")
+        try:
+            async with self.server:
+                await stop
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.pool.shutdown(cancel_futures=True)
+            if os.path.exists(self.socketPath):
+                os.unlink(self.socketPath)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="T34 assembler daemon")
+    parser.add_argument("--socket", default=None, help="path of the Unix socket to listen on")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes")
+    args = parser.parse_args()
+    asyncio.run(t34Daemon(args.socket, args.jobs).serve())
@@ -0,0 +1,245 @@
+import sys, time, random, argparse
+from t34Assembler import t34Assembler, OPCODE_TABLE, OPERAND_MODES, ADDRESSING_MODES
+
+# Operand syntax of every addressing mode, written so assembling it again picks the same mode
+OPERAND_FORMATS = {
+    "IMPLIED": "",
+    "ACCUMULATOR": "A",
+    "IMMEDIATE": "#{}",
+    "ZEROPAGE": "{}",
+    "ZEROPAGEX": "{},X",
+    "ZEROPAGEY": "{},Y",
+    "ABSOLUTE": "{}",
+    "ABSOLUTEX": "{},X",
+    "ABSOLUTEY": "{},Y",
+    "INDIRECTX": "({},X)",
+    "INDIRECTY": "({}),Y",
+    "INDIRECT": "({})",
+    "RELATIVE": "{}"
+}
+
+# Zero page form of every absolute mode, a value that fits in a byte is only written as absolute with four hex digits
+NARROW_MODES = {wide: narrow for narrow, wide in OPERAND_MODES.values() if narrow and wide and narrow != wide}
+
+def build_decode_table(table):
+    # Invert the opcode table into (instr, mode, size, line) for each of the 256 opcodes, None for the unused ones
+    # line is the unlabeled source line with a hex operand, formatting it with the operand value is all an instruction costs
+    decode = [None] * 256
+    for (instr, mode), opcode in table.items():
+        size = ADDRESSING_MODES[mode]
+        digits = "${:04X}" if size == 3 or mode == "RELATIVE" else "${:02X}"
+        line = f"{'':<9}{instr:<5}{OPERAND_FORMATS[mode].replace('{}', digits)}".rstrip()
+        decode[opcode] = (instr, mode, size, line)
+    return decode
+
+DECODE_TABLE = build_decode_table(OPCODE_TABLE)
+
+def decode(data, origin=0, start=0, end=None):
+    # Yield (address, entry, value) for every instruction in data[start:end] loaded at origin
+    # entry is None for a byte that is not an opcode or an instruction cut off by the end, value is then the byte
+    table = DECODE_TABLE
+    end = len(data) if end == None else end
+    base = origin - start
+    i = start
+    while i < end:
+        byte = data[i]
+        entry = table[byte]
+        if entry == None:
+            yield (base + i) & 0xFFFF, None, byte
+            i += 1
+            continue
+        size = entry[2]
+        if i + size > end:
+            yield (base + i) & 0xFFFF, None, byte
+            i += 1
+        elif size == 1:
+            yield (base + i) & 0xFFFF, entry, None
+            i += 1
+        elif size == 2:
+            value = data[i + 1]
+            # Branches are decoded to their destination, the offset counts from the next instruction
+            if entry[1] == "RELATIVE":
+                value = (base + i + 2 + (value ^ 0x80) - 0x80) & 0xFFFF
+            yield (base + i) & 0xFFFF, entry, value
+            i += 2
+        else:
+            yield (base + i) & 0xFFFF, entry, data[i + 1] | data[i + 2] << 8
+            i += 3
+
+class t34Disassembler:
+    # Turns memory back into T34 source, annotated with the symbols of an assembler run when it is given them
+    def __init__(self, symbols=None):
+        self.symbols = symbols
+        self.reset()
+
+    def reset(self):
+        self.lines = []
+        # Symbols used by operands and the ones placed as labels, the rest are defined with EQU
+        self.used = {}
+        self.labels = set()
+        self.unknown = 0
+
+    def __operand(self, instr, mode, value):
+        # Symbol or hex literal for the operand value
+        if mode == "RELATIVE" or mode.startswith("ABSOLUTE") or mode == "INDIRECT":
+            name = self.__symbol(value, instr, mode)
+            return name if name else f"${value:04X}"
+        if mode == "IMMEDIATE":
+            return f"${value:02X}"
+        name = self.__symbol(value, instr, mode)
+        return name if name else f"${value:02X}"
+
+    def __symbol(self, value, instr, mode):
+        # A symbol only replaces an address it would be assembled back to in the same mode
+        if not self.symbols:
+            return None
+        narrow = NARROW_MODES.get(mode)
+        if narrow and value <= 0xFF and (instr, narrow) in OPCODE_TABLE:
+            return None
+        name = self.symbols.lookup(value)
+        if name != None:
+            self.used[name] = value
+        return name
+
+    def disassemble(self, data, origin=0, start=0, end=None):
+        # Source lines for the bytes in data[start:end] loaded at origin, ORG first
+        self.lines.append(f"{'':<9}{'ORG':<5}${origin:04X}")
+        return self.__decode(data, origin, start, end)
+
+    def __decode(self, data, origin, start, end):
+        symbols = self.symbols
+        lines = self.lines
+        for address, entry, value in decode(data, origin, start, end):
+            if entry == None:
+                # There is no directive for raw bytes, they are kept as comments
+                lines.append(f"* {address:04X}: {value:02X}")
+                self.unknown += 1
+                continue
+            if symbols == None:
+                lines.append(entry[3].format(value))
+                continue
+            label = symbols.lookup(address)
+            if label != None:
+                self.labels.add(label)
+            else:
+                label = ""
+            instr, mode, size, line = entry
+            if size == 1:
+                lines.append(f"{label:<8} {line[9:]}" if label else line)
+            else:
+                lines.append(f"{label:<8} {instr:<5}{OPERAND_FORMATS[mode].format(self.__operand(instr, mode, value))}")
+        return lines
+
+    def disassemble_image(self, image):
+        # The records of an assembled image mark where its instructions and checksums start, decoding them one at a time is exact
+        # Without them, or when later code was written over earlier records, every used range is decoded under its own ORG
+        records = [record for record in image.records if record != None]
+        if not records or sum(size for address, size, checksum in records) != sum(end - start for start, end in image.ranges()):
+            for start, end in image.ranges():
+                self.disassemble(image.memory, start, start, end)
+            return self.source()
+
+        pc = None
+        for address, size, checksum in records:
+            if address != pc:
+                self.lines.append(f"{'':<9}{'ORG':<5}${address:04X}")
+            if checksum:
+                self.lines.append(f"{'':<9}CHK")
+            else:
+                self.__decode(image.memory, address, address, address + size)
+            pc = address + size
+        return self.source()
+
+    def source(self):
+        # Symbols used by operands but not placed as labels are defined first
+        constants = [f"{name:<8} {'EQU':<5}${value:04X}" for name, value in sorted(self.used.items(), key=lambda item: item[1]) if name not in self.labels]
+        return constants + self.lines
+
+def disassemble(data, origin=0, symbols=None):
+    # Source text for a memory image or a bytes-like object loaded at origin
+    disassembler = t34Disassembler(symbols)
+    if hasattr(data, "ranges"):
+        lines = disassembler.disassemble_image(data)
+    else:
+        disassembler.disassemble(data, origin)
+        lines = disassembler.source()
+    return "\n".join(lines) + "\n"
+
+def reassemble(source):
+    assembler = t34Assembler(batch=True, listing=None)
+    assembler.source = source.splitlines(True)
+    return assembler.assemble()
+
+def round_trip():
+    # Assemble every opcode, disassemble it with and without symbols and check that both assemble to the same bytes
+    lines = ["ZP       EQU  $0012", "TABLE    EQU  $1234", "         ORG  $8000"]
+    for count, ((instr, mode), opcode) in enumerate(sorted(OPCODE_TABLE.items(), key=lambda item: item[1])):
+        if mode == "RELATIVE":
+            operand = f"L{count}"
+        elif mode.startswith("ZEROPAGE") or mode in ("INDIRECTX", "INDIRECTY"):
+            operand = OPERAND_FORMATS[mode].format("ZP")
+        elif mode == "IMMEDIATE":
+            operand = "#$7F"
+        else:
+            operand = OPERAND_FORMATS[mode].format("TABLE")
+        lines.append(f"L{count:<8}{instr:<5}{operand}".rstrip())
+    source = "\n".join(lines) + "\n"
+
+    first = reassemble(source)
+    failures = []
+    if first.errors:
+        failures.append(f"source: {[str(d) for d in first.diagnostics]}")
+    for symbols in (None, first.symbols):
+        second = reassemble(disassemble(first.image, symbols=symbols))
+        name = "with symbols" if symbols else "without symbols"
+        if second.errors:
+            failures.append(f"{name}: {[str(d) for d in second.diagnostics]}")
+        elif second.image.memory != first.image.memory or second.image.ranges() != first.image.ranges():
+            failures.append(f"{name}: bytes differ")
+    return len(OPCODE_TABLE), failures
+
+def throughput(size, seed=0):
+    # Instructions and megabytes decoded per second from random bytes
+    data = bytearray(random.Random(seed).randbytes(size))
+    start = time.perf_counter()
+    instructions = sum(1 for item in decode(data))
+    decoded = time.perf_counter() - start
+    start = time.perf_counter()
+    text = disassemble(data)
+    formatted = time.perf_counter() - start
+    return instructions, size / decoded / 1e6, size / formatted / 1e6, len(text)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="T34 disassembler")
+    parser.add_argument("image", nargs="?", help="raw binary image to disassemble")
+    parser.add_argument("--origin", default="0", help="address the image is loaded at, in hex")
+    parser.add_argument("--source", help="assemble this source and annotate the output with its symbols")
+    parser.add_argument("--check", action="store_true", help="round trip every opcode through the assembler")
+    parser.add_argument("--benchmark", type=int, metavar="BYTES", help="decode this many random bytes and report the speed")
+    args = parser.parse_args()
+
+    if args.check:
+        count, failures = round_trip()
+        for failure in failures:
+            print(failure)
+        print(f"Round trip of {count} opcodes: {'FAILED' if failures else 'OK'}")
+        sys.exit(1 if failures else 0)
+    if args.benchmark:
+        instructions, decodeRate, formatRate, characters = throughput(args.benchmark)
+        print(f"{args.benchmark} bytes, {instructions} instructions, decode {decodeRate:.2f} MB/s, disassemble {formatRate:.2f} MB/s")
+        sys.exit(0)
+    if not args.image:
+        parser.error("an image, --check or --benchmark is required")
+
+    symbols = None
+    if args.source:
+        assembler = t34Assembler(batch=True, listing=None)
+        if not assembler.fopen(args.source):
+            print(f"Unable to open {args.source}.")
+            sys.exit(1)
+        assembler.fread()
+        assembler.fclose()
+        symbols = assembler.assemble().symbols
+    with open(args.image, "rb") as file:
+        data = file.read()
+    sys.stdout.write(disassemble(data, int(args.origin.lstrip("$"), 16), symbols))
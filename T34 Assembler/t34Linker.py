@@ -0,0 +1,114 @@
+import os, sys, argparse
+from t34Assembler import t34Image, t34SymbolTable, t34Diagnostic, t34Result, read_module, OBJECT_WRITERS
+
+class t34Linker:
+    # Places relocatable modules one after another, resolves their imports and relocates them into one image
+    def __init__(self, base=0x8000):
+        self.base = base
+        self.modules = []
+        # Address of every module once it is linked
+        self.addresses = []
+
+    def add(self, module):
+        self.modules.append(module)
+
+    def add_file(self, path):
+        # Read a module file, False if it is not a module in the current format
+        with open(path, "r") as file:
+            module = read_module(file)
+        if module == None:
+            return False
+        if not module.name:
+            module.name = path
+        self.modules.append(module)
+        return True
+
+    def link(self):
+        # Image of every module at its address, with the exported symbols at their linked values
+        diagnostics = []
+        symbols = t34SymbolTable()
+        owners = {}
+
+        # Every module starts where the one before it ends
+        addresses = []
+        address = self.base
+        for module in self.modules:
+            addresses.append(address)
+            address += module.size
+        if address > 0x10000:
+            diagnostics.append(t34Diagnostic("MEMORY_FULL", None, None, f"{address - self.base:X} bytes from {self.base:04X}"))
+            return t34Result(len(diagnostics), 0, diagnostics, t34Image(), symbols)
+
+        for module, address in zip(self.modules, addresses):
+            for name, (value, relocated) in module.exports.items():
+                if name in owners:
+                    diagnostics.append(t34Diagnostic("DUPLICATE_EXPORT", None, None, f"{name} in {owners[name]} and {module.name}"))
+                    continue
+                owners[name] = module.name
+                symbols[name] = value + address if relocated else value
+
+        # Relocated words are patched in a copy of each module, the checksums are computed again as the image is emitted
+        image = t34Image()
+        for module, address in zip(self.modules, addresses):
+            memory = bytearray(module.memory)
+            for offset, name in module.relocations:
+                if name == None:
+                    amount = address
+                elif name in symbols:
+                    amount = symbols[name]
+                else:
+                    diagnostics.append(t34Diagnostic("UNDEFINED_IMPORT", None, None, f"{name} in {module.name}"))
+                    continue
+                word = (memory[offset] | memory[offset + 1] << 8) + amount
+                if word > 0xFFFF:
+                    diagnostics.append(t34Diagnostic("BAD_RELOCATION", None, None, f"{address + offset:04X} in {module.name}"))
+                    continue
+                memory[offset] = word & 0xFF
+                memory[offset + 1] = word >> 8
+            for offset, size, checksum in module.records:
+                if checksum:
+                    image.emit(address + offset, bytes((image.checksum,)), True)
+                else:
+                    image.emit(address + offset, memory[offset:offset + size])
+
+        self.addresses = addresses
+        return t34Result(len(diagnostics), image.bytes, diagnostics, image, symbols)
+
+    def map(self):
+        # Address, size and name of every module once it is linked
+        return [f"{address:04X} {module.size:>6X}  {module.name}" for module, address in zip(self.modules, self.addresses)]
+
+def output_format(path):
+    # Format of a linked image by the extension of its file, text records unless it is .bin or .hex
+    extension = os.path.splitext(path)[1][1:]
+    return extension if extension in ("bin", "hex") else "text"
+
+def write_image(image, path):
+    writer, mode = OBJECT_WRITERS[output_format(path)]
+    with open(path, mode) as file:
+        writer(image, file)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="T34 linker")
+    parser.add_argument("modules", nargs="+", help="relocatable module files, in the order they are placed")
+    parser.add_argument("-o", "--output", required=True, help="linked image, .bin for a raw binary, .hex for Intel HEX, text records otherwise")
+    parser.add_argument("--base", default="8000", help="address of the first module, in hex")
+    parser.add_argument("--map", action="store_true", help="print where every module and symbol ended up")
+    args = parser.parse_args()
+
+    linker = t34Linker(int(args.base.lstrip("$"), 16))
+    for path in args.modules:
+        if not os.path.exists(path) or not linker.add_file(path):
+            print(f"Unable to read module {path}.")
+            sys.exit(1)
+    result = linker.link()
+    for diagnostic in result.diagnostics:
+        print(diagnostic)
+    if result.errors:
+        sys.exit(1)
+    write_image(result.image, args.output)
+    if args.map:
+        print("\n".join(linker.map()))
+        for value, name in result.symbols.numerical():
+            print(f"{value:04X}  {name}")
+    print(f"--Linked {len(linker.modules)} modules, {result.bytes} bytes")
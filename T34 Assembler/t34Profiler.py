@@ -0,0 +1,161 @@
+import json, cProfile
+from time import perf_counter
+from t34Assembler import compile_operand
+
+# Private assembler methods the profiler times, the phases first and then the hot path of every line
+PROFILED_METHODS = (
+    "full_first_pass", "cached_first_pass", "assembler_print", "one_pass",
+    "first_pass", "read_format", "get_addressing_mode", "do_operations", "replace_symbols",
+    "encode", "extract_address", "list", "symbol_print"
+)
+
+# Public methods that write the object code
+OUTPUT_METHODS = ("fwrite", "getCode")
+
+# Entry points that start a run
+RUN_METHODS = ("assemble", "assemble_one_pass", "assemble_stream")
+
+class t34Profiler:
+    # Opt-in timers and counters for an assembler, an assembler without one runs its methods unwrapped
+    def __init__(self, cprofile=False):
+        self.cprofile = cProfile.Profile() if cprofile else None
+        self.timers = {}
+        self.paths = {}
+        self.stack = []
+        self.overhead = (0.0, 0.0)
+        self.overhead = self.__calibrate()
+        self.reset()
+
+    def __calibrate(self, calls=20000):
+        # Time a timer adds inside and outside its own measurement of an empty function, both are taken off every call
+        timed = self.__timed("calibrate", lambda: None)
+        start = perf_counter()
+        for i in range(calls):
+            timed()
+        elapsed = perf_counter() - start
+        measured = self.timers.pop("calibrate")[1]
+        self.paths.clear()
+        return measured / calls, max(0.0, elapsed - measured) / calls
+
+    def reset(self):
+        # Forget every run measured so far, the timed methods keep their records so they are cleared in place
+        for record in self.timers.values():
+            record[:] = [0, 0.0, 0.0]
+        self.paths.clear()
+        self.counters = {"runs": 0, "operandLookups": 0, "regexMatches": 0, "bytesEmitted": 0}
+
+    def attach(self, assembler):
+        # Shadow the methods of this assembler instance with timed ones, the class is left untouched
+        # cProfile already times every function, timing them again would only add the timers to its statistics
+        if not self.cprofile:
+            for name in PROFILED_METHODS:
+                attribute = "_t34Assembler__" + name
+                setattr(assembler, attribute, self.__timed(name, getattr(assembler, attribute)))
+        for name in OUTPUT_METHODS:
+            setattr(assembler, name, self.__timed(name, getattr(assembler, name)))
+        for name in RUN_METHODS:
+            setattr(assembler, name, self.__run(name, getattr(assembler, name)))
+
+    def __timed(self, name, function):
+        # Calls, total time and time spent outside the other timed methods, also kept per call path for speedscope
+        record = self.timers.setdefault(name, [0, 0.0, 0.0])
+        stack = self.stack
+        paths = self.paths
+        inside, outside = self.overhead
+
+        def timed(*args, **kwargs):
+            # A frame is the call path, the time of the timed methods it called and the overhead of their timers
+            frame = [stack[-1][0] + (name,) if stack else (name,), 0.0, 0.0]
+            stack.append(frame)
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = max(0.0, perf_counter() - start - inside - frame[2])
+                stack.pop()
+                if stack:
+                    caller = stack[-1]
+                    caller[1] += elapsed
+                    caller[2] += frame[2] + inside + outside
+                own = max(0.0, elapsed - frame[1])
+                record[0] += 1
+                record[1] += elapsed
+                record[2] += own
+                paths[frame[0]] = paths.get(frame[0], 0.0) + own
+        return timed
+
+    def __run(self, name, function):
+        # Count what a whole run did, compile_operand is shared so only its growth during the run is counted
+        timed = self.__timed(name, function)
+
+        def run(*args, **kwargs):
+            before = compile_operand.cache_info()
+            if self.cprofile:
+                self.cprofile.enable()
+            try:
+                result = timed(*args, **kwargs)
+            finally:
+                if self.cprofile:
+                    self.cprofile.disable()
+            after = compile_operand.cache_info()
+            counters = self.counters
+            counters["runs"] += 1
+            counters["operandLookups"] += after.hits + after.misses - before.hits - before.misses
+            counters["regexMatches"] += after.misses - before.misses
+            # Symbol lookups are counted by the replace_symbols timer, which cProfile runs do without
+            if "replace_symbols" in self.timers:
+                counters["symbolLookups"] = self.timers["replace_symbols"][0]
+            if result != None:
+                counters["bytesEmitted"] += result.bytes
+            return result
+        return run
+
+    def stats(self):
+        # Timers as calls, total and self seconds, largest self time first
+        timers = sorted(self.timers.items(), key=lambda item: -item[1][2])
+        return {
+            "counters": dict(self.counters),
+            "timers": {name: {"calls": calls, "seconds": total, "self": own} for name, (calls, total, own) in timers if calls}
+        }
+
+    def dump(self, path):
+        # A .json path gets a speedscope profile, anything else the cProfile statistics
+        if path.endswith(".json"):
+            self.write_speedscope(path)
+        elif self.cprofile:
+            self.cprofile.dump_stats(path)
+        else:
+            raise ValueError("cProfile statistics need a profiler created with cprofile=True")
+
+    def write_speedscope(self, path):
+        # Self time of every call path as one weighted sample, see https://www.speedscope.app/file-format-schema.json
+        frames = {}
+        samples = []
+        weights = []
+        for stack, seconds in self.paths.items():
+            samples.append([frames.setdefault(name, len(frames)) for name in stack])
+            weights.append(seconds)
+        profile = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "exporter": "t34Profiler",
+            "name": "T34 assembler",
+            "shared": {"frames": [{"name": name} for name in frames]},
+            "profiles": [{
+                "type": "sampled",
+                "name": "T34 assembler",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights
+            }]
+        }
+        with open(path, "w") as file:
+            json.dump(profile, file)
+
+    def __str__(self):
+        lines = [f"{'Method':<24}{'Calls':>10}{'Total ms':>12}{'Self ms':>12}"]
+        for name, timer in self.stats()["timers"].items():
+            lines.append(f"{name:<24}{timer['calls']:>10}{timer['seconds'] * 1000:>12.2f}{timer['self'] * 1000:>12.2f}")
+        lines.append(", ".join(f"{name}: {value}" for name, value in self.counters.items()))
+        return "\n".join(lines)
@@ -0,0 +1,415 @@
+import sys, time, argparse
+from t34Assembler import t34Assembler, OPCODE_TABLE, ADDRESSING_MODES
+
+# Code that leaves the effective address of an addressing mode in a, b is the address before indexing
+ADDRESS_CODE = {
+    "IMPLIED": "",
+    "ACCUMULATOR": "",
+    "IMMEDIATE": "a = (pc + 1) & 0xFFFF",
+    "ZEROPAGE": "a = m[(pc + 1) & 0xFFFF]",
+    "ZEROPAGEX": "a = (m[(pc + 1) & 0xFFFF] + s.x) & 0xFF",
+    "ZEROPAGEY": "a = (m[(pc + 1) & 0xFFFF] + s.y) & 0xFF",
+    "ABSOLUTE": "a = m[(pc + 1) & 0xFFFF] | m[(pc + 2) & 0xFFFF] << 8",
+    "ABSOLUTEX": "b = m[(pc + 1) & 0xFFFF] | m[(pc + 2) & 0xFFFF] << 8; a = (b + s.x) & 0xFFFF",
+    "ABSOLUTEY": "b = m[(pc + 1) & 0xFFFF] | m[(pc + 2) & 0xFFFF] << 8; a = (b + s.y) & 0xFFFF",
+    "INDIRECTX": "z = (m[(pc + 1) & 0xFFFF] + s.x) & 0xFF; a = m[z] | m[(z + 1) & 0xFF] << 8",
+    "INDIRECTY": "z = m[(pc + 1) & 0xFFFF]; b = m[z] | m[(z + 1) & 0xFF] << 8; a = (b + s.y) & 0xFFFF",
+    # The pointer of JMP ($xxFF) wraps within its page like it does on the 6502
+    "INDIRECT": "b = m[(pc + 1) & 0xFFFF] | m[(pc + 2) & 0xFFFF] << 8; a = m[b] | m[(b & 0xFF00) | ((b + 1) & 0xFF)] << 8",
+    "RELATIVE": ""
+}
+
+# Cycles of each addressing mode for instructions that read memory, the indexed ones take one more when they cross a page
+MODE_CYCLES = {
+    "IMPLIED": 2, "ACCUMULATOR": 2, "IMMEDIATE": 2, "ZEROPAGE": 3, "ZEROPAGEX": 4, "ZEROPAGEY": 4, "ABSOLUTE": 4,
+    "ABSOLUTEX": 4, "ABSOLUTEY": 4, "INDIRECTX": 6, "INDIRECTY": 5, "INDIRECT": 5, "RELATIVE": 2
+}
+PAGE_CROSSING = {"ABSOLUTEX", "ABSOLUTEY", "INDIRECTY"}
+
+# Instructions that read, write back or only write their operand, the others have their cycles listed by instruction
+READS = {"ADC", "AND", "BIT", "CMP", "CPX", "CPY", "EOR", "LDA", "LDX", "LDY", "ORA", "SBC"}
+MODIFIES = {"ASL", "LSR", "ROL", "ROR", "INC", "DEC"}
+WRITES = {"STA", "STX", "STY"}
+MODIFY_CYCLES = {"ACCUMULATOR": 2, "ZEROPAGE": 5, "ZEROPAGEX": 6, "ABSOLUTE": 6, "ABSOLUTEX": 7}
+WRITE_CYCLES = {"ABSOLUTEX": 5, "ABSOLUTEY": 5, "INDIRECTY": 6}
+INSTRUCTION_CYCLES = {"PHA": 3, "PHP": 3, "PLA": 4, "PLP": 4, "RTS": 6, "RTI": 6, "BRK": 7, "JSR": 6, "JMP": 3}
+
+# Conditions the branches take on the flags
+BRANCHES = {
+    "BCC": "not s.c", "BCS": "s.c", "BEQ": "s.z", "BNE": "not s.z",
+    "BMI": "s.n", "BPL": "not s.n", "BVC": "not s.v", "BVS": "s.v"
+}
+
+# Body of every instruction, v is the operand value read from a, R and W read and write the operand wherever it is
+# The bodies of the jumps set pc and return their cycles themselves
+INSTRUCTION_CODE = {
+    "LDA": "s.a = v = m[a]; s.z = v == 0; s.n = v >> 7",
+    "LDX": "s.x = v = m[a]; s.z = v == 0; s.n = v >> 7",
+    "LDY": "s.y = v = m[a]; s.z = v == 0; s.n = v >> 7",
+    "STA": "m[a] = s.a",
+    "STX": "m[a] = s.x",
+    "STY": "m[a] = s.y",
+    "TAX": "s.x = v = s.a; s.z = v == 0; s.n = v >> 7",
+    "TAY": "s.y = v = s.a; s.z = v == 0; s.n = v >> 7",
+    "TXA": "s.a = v = s.x; s.z = v == 0; s.n = v >> 7",
+    "TYA": "s.a = v = s.y; s.z = v == 0; s.n = v >> 7",
+    "TSX": "s.x = v = s.sp; s.z = v == 0; s.n = v >> 7",
+    "TXS": "s.sp = s.x",
+    "AND": "s.a = v = s.a & m[a]; s.z = v == 0; s.n = v >> 7",
+    "ORA": "s.a = v = s.a | m[a]; s.z = v == 0; s.n = v >> 7",
+    "EOR": "s.a = v = s.a ^ m[a]; s.z = v == 0; s.n = v >> 7",
+    "BIT": "v = m[a]; s.z = s.a & v == 0; s.n = v >> 7; s.v = v >> 6 & 1",
+    "CMP": "v = s.a - m[a]; s.c = v >= 0; v &= 0xFF; s.z = v == 0; s.n = v >> 7",
+    "CPX": "v = s.x - m[a]; s.c = v >= 0; v &= 0xFF; s.z = v == 0; s.n = v >> 7",
+    "CPY": "v = s.y - m[a]; s.c = v >= 0; v &= 0xFF; s.z = v == 0; s.n = v >> 7",
+    "ADC": "s.add(m[a])",
+    "SBC": "s.subtract(m[a])",
+    "INC": "v = (m[a] + 1) & 0xFF; m[a] = v; s.z = v == 0; s.n = v >> 7",
+    "DEC": "v = (m[a] - 1) & 0xFF; m[a] = v; s.z = v == 0; s.n = v >> 7",
+    "INX": "s.x = v = (s.x + 1) & 0xFF; s.z = v == 0; s.n = v >> 7",
+    "INY": "s.y = v = (s.y + 1) & 0xFF; s.z = v == 0; s.n = v >> 7",
+    "DEX": "s.x = v = (s.x - 1) & 0xFF; s.z = v == 0; s.n = v >> 7",
+    "DEY": "s.y = v = (s.y - 1) & 0xFF; s.z = v == 0; s.n = v >> 7",
+    "ASL": "v = R << 1; s.c = v >> 8; v &= 0xFF; W; s.z = v == 0; s.n = v >> 7",
+    "LSR": "v = R; s.c = v & 1; v >>= 1; W; s.z = v == 0; s.n = 0",
+    "ROL": "v = R << 1 | s.c; s.c = v >> 8; v &= 0xFF; W; s.z = v == 0; s.n = v >> 7",
+    "ROR": "v = R; c = v & 1; v = v >> 1 | s.c << 7; s.c = c; W; s.z = v == 0; s.n = v >> 7",
+    "CLC": "s.c = 0",
+    "SEC": "s.c = 1",
+    "CLD": "s.d = 0",
+    "SED": "s.d = 1",
+    "CLI": "s.i = 0",
+    "SEI": "s.i = 1",
+    "CLV": "s.v = 0",
+    "NOP": "",
+    "PHA": "s.push(s.a)",
+    "PHP": "s.push(s.status() | 0x10)",
+    "PLA": "s.a = v = s.pull(); s.z = v == 0; s.n = v >> 7",
+    "PLP": "s.set_status(s.pull())",
+    "JMP": "s.pc = a",
+    "JSR": "v = (pc + 2) & 0xFFFF; s.push(v >> 8); s.push(v & 0xFF); s.pc = a",
+    "RTS": "v = s.pull(); s.pc = (v | s.pull() << 8) + 1 & 0xFFFF",
+    "RTI": "s.set_status(s.pull()); v = s.pull(); s.pc = v | s.pull() << 8",
+    "BRK": "s.interrupt(pc)"
+}
+JUMPS = {"JMP", "JSR", "RTS", "RTI", "BRK"}
+
+class t34Halt(Exception):
+    # Raised by an instruction that stops the run, the reason is the first argument
+    pass
+
+def handler_source(instr, mode):
+    # Python lines of the body of the handler of one opcode, it runs the instruction and returns its cycles
+    if mode == "RELATIVE":
+        return [
+            f"if {BRANCHES[instr]}:",
+            "    a = (pc + 2 + (m[(pc + 1) & 0xFFFF] ^ 0x80) - 0x80) & 0xFFFF",
+            "    s.pc = a",
+            "    return 3 + ((pc + 2 ^ a) > 0xFF)",
+            "s.pc = (pc + 2) & 0xFFFF",
+            "return 2"
+        ]
+
+    if instr in MODIFIES:
+        cycles = MODIFY_CYCLES[mode]
+    elif instr in WRITES:
+        cycles = WRITE_CYCLES.get(mode, MODE_CYCLES[mode])
+    elif instr in INSTRUCTION_CYCLES:
+        cycles = INSTRUCTION_CYCLES[instr] + (2 if mode == "INDIRECT" else 0)
+    else:
+        cycles = MODE_CYCLES[mode]
+    if instr in READS and mode in PAGE_CROSSING:
+        cycles = f"{cycles} + ((b ^ a) > 0xFF)"
+
+    # Shifts and rotates work on the accumulator or on memory
+    body = INSTRUCTION_CODE[instr]
+    if instr in MODIFIES:
+        operand = "s.a" if mode == "ACCUMULATOR" else "m[a]"
+        body = body.replace("R", operand).replace("W", f"{operand} = v")
+    lines = [ADDRESS_CODE[mode], body]
+    if instr not in JUMPS:
+        lines.append(f"s.pc = (pc + {ADDRESSING_MODES[mode]}) & 0xFFFF")
+    lines.append(f"return {cycles}")
+    return [line for line in lines if line]
+
+def compile_handlers():
+    # One factory builds the handlers of every opcode around the memory of a simulator, the source is compiled once
+    names = {}
+    source = ["def factory(m):"]
+    for (instr, mode), opcode in sorted(OPCODE_TABLE.items(), key=lambda item: item[1]):
+        names[opcode] = f"op{opcode:02X}"
+        source.append(f"    def op{opcode:02X}(s):")
+        source.extend(f"        {line}" for line in ["pc = s.pc"] + handler_source(instr, mode))
+    source.append("    return {" + ", ".join(f"{opcode}: {name}" for opcode, name in names.items()) + "}")
+    scope = {}
+    exec(compile("\n".join(source), "<t34 handlers>", "exec"), scope)
+    return scope["factory"]
+
+HANDLER_FACTORY = compile_handlers()
+
+def illegal(s):
+    raise t34Halt("illegal")
+
+class t34Simulator:
+    # T34 CPU running an assembled image, registers and flags are ints and memory is a bytearray
+    __slots__ = ("memory", "handlers", "breakpoints", "stopOnBrk", "instructions", "cycles", "reason",
+                 "a", "x", "y", "sp", "pc", "c", "z", "i", "d", "v", "n")
+
+    def __init__(self, image=None, start=None, stopOnBrk=True):
+        self.memory = bytearray(0x10000)
+        # 256 handlers indexed by opcode, the ones the opcode table does not define stop the run
+        defined = HANDLER_FACTORY(self.memory)
+        self.handlers = [defined.get(opcode, illegal) for opcode in range(256)]
+        self.breakpoints = set()
+        # BRK ends the run like the end of a program, otherwise it goes through the interrupt vector at $FFFE
+        self.stopOnBrk = stopOnBrk
+        self.reset()
+        if image != None:
+            self.load(image, start)
+
+    def reset(self, start=0):
+        self.a = self.x = self.y = 0
+        self.sp = 0xFF
+        self.pc = start
+        self.c = self.z = self.d = self.v = self.n = 0
+        self.i = 1
+        self.instructions = 0
+        self.cycles = 0
+        self.reason = None
+
+    def load(self, image, start=None):
+        # Copy an assembled image into memory, the run starts at its first record unless told otherwise
+        self.memory[:] = image.memory
+        records = [record for record in image.records if record != None]
+        if start == None:
+            start = records[0][0] if records else image.ranges()[0][0] if image.ranges() else 0
+        self.reset(start)
+
+    def load_object(self, path, start=None):
+        # Load an object file in the text format, one "address: bytes" record per line
+        first = None
+        with open(path, "r") as file:
+            for text in file:
+                if ":" not in text:
+                    continue
+                address, data = text.split(":", 1)
+                address = int(address, 16)
+                # Checksum records are written without padding
+                data = bytes(int(byte, 16) for byte in data.split())
+                self.memory[address:address + len(data)] = data
+                if first == None:
+                    first = address
+        self.reset(first if start == None else start)
+
+    def status(self):
+        # Processor status byte, bit 5 always reads as set
+        return self.n << 7 | self.v << 6 | 0x20 | self.d << 3 | self.i << 2 | self.z << 1 | self.c
+
+    def set_status(self, p):
+        self.n = p >> 7
+        self.v = p >> 6 & 1
+        self.d = p >> 3 & 1
+        self.i = p >> 2 & 1
+        self.z = p >> 1 & 1
+        self.c = p & 1
+
+    def push(self, value):
+        self.memory[0x100 | self.sp] = value
+        self.sp = (self.sp - 1) & 0xFF
+
+    def pull(self):
+        self.sp = (self.sp + 1) & 0xFF
+        return self.memory[0x100 | self.sp]
+
+    def add(self, value):
+        # ADC, in decimal mode the digits are added as BCD like the NMOS 6502 and N and V come from the binary sum
+        a = self.a
+        total = a + value + self.c
+        self.v = (~(a ^ value) & (a ^ total)) >> 7 & 1
+        self.z = total & 0xFF == 0
+        if self.d:
+            low = (a & 0x0F) + (value & 0x0F) + self.c
+            if low > 9:
+                low += 6
+            high = (a >> 4) + (value >> 4) + (low > 0x0F)
+            self.n = high >> 3 & 1
+            self.v = (~(a ^ value) & (a ^ high << 4)) >> 7 & 1
+            if high > 9:
+                high += 6
+            self.c = high > 0x0F
+            self.a = (high << 4 | low & 0x0F) & 0xFF
+            return
+        self.c = total >> 8
+        self.a = total = total & 0xFF
+        self.n = total >> 7
+
+    def subtract(self, value):
+        # SBC is ADC of the inverted operand in binary mode, decimal mode borrows per digit
+        if not self.d:
+            self.add(value ^ 0xFF)
+            return
+        a = self.a
+        total = a - value - (1 - self.c)
+        low = (a & 0x0F) - (value & 0x0F) - (1 - self.c)
+        high = (a >> 4) - (value >> 4)
+        if low < 0:
+            low -= 6
+            high -= 1
+        if high < 0:
+            high -= 6
+        self.v = ((a ^ value) & (a ^ total)) >> 7 & 1
+        self.c = total >= 0
+        total &= 0xFF
+        self.z = total == 0
+        self.n = total >> 7
+        self.a = (high << 4 | low & 0x0F) & 0xFF
+
+    def interrupt(self, pc):
+        # BRK pushes the address after its padding byte and the status with the break flag, then jumps through $FFFE
+        if self.stopOnBrk:
+            raise t34Halt("brk")
+        pc = (pc + 2) & 0xFFFF
+        self.push(pc >> 8)
+        self.push(pc & 0xFF)
+        self.push(self.status() | 0x10)
+        self.i = 1
+        self.pc = self.memory[0xFFFE] | self.memory[0xFFFF] << 8
+
+    def run(self, maxInstructions=None):
+        # Run until BRK, an illegal opcode, a breakpoint or the instruction budget, returns the reason it stopped
+        # A breakpoint stops the run before its instruction, except where the run starts so it can be continued
+        handlers = self.handlers
+        memory = self.memory
+        breakpoints = self.breakpoints
+        limit = sys.maxsize if maxInstructions == None else maxInstructions
+        count = 0
+        cycles = 0
+        reason = "budget"
+        try:
+            if breakpoints:
+                if count < limit:
+                    cycles += handlers[memory[self.pc]](self)
+                    count += 1
+                while count < limit:
+                    if self.pc in breakpoints:
+                        reason = "breakpoint"
+                        break
+                    cycles += handlers[memory[self.pc]](self)
+                    count += 1
+            else:
+                while count < limit:
+                    cycles += handlers[memory[self.pc]](self)
+                    count += 1
+        except t34Halt as halt:
+            reason = halt.args[0]
+            # BRK counts as run, it leaves pc at itself
+            if reason == "brk":
+                count += 1
+                cycles += 7
+        self.instructions += count
+        self.cycles += cycles
+        self.reason = reason
+        return reason
+
+    def step(self):
+        # Run one instruction
+        return self.run(1)
+
+    def registers(self):
+        return {"pc": self.pc, "a": self.a, "x": self.x, "y": self.y, "sp": self.sp, "p": self.status()}
+
+    def __str__(self):
+        registers = " ".join(f"{name.upper()}={value:0{4 if name == 'pc' else 2}X}" for name, value in self.registers().items())
+        return f"{registers} instructions={self.instructions} cycles={self.cycles}"
+
+# Program the benchmark runs forever, a mix of loads, stores, arithmetic, indexing, branches and a subroutine
+BENCHMARK = """* T34 simulator benchmark
+SUM      EQU  $10
+PTR      EQU  $20
+TABLE    EQU  $0300
+         ORG  $0200
+START    LDA  #$00
+         STA  PTR
+         LDA  #$03
+         STA  PTR+1
+         LDX  #$00
+FILL     TXA
+         STA  TABLE,X
+         INX
+         BNE  FILL
+LOOP     LDY  #$00
+         CLC
+INNER    LDA  (PTR),Y
+         ADC  SUM
+         STA  SUM
+         JSR  MIX
+         INY
+         BNE  INNER
+         INC  SUM+1
+         JMP  LOOP
+MIX      LDA  SUM
+         EOR  #$5A
+         ROL
+         STA  SUM+2
+         RTS
+"""
+
+def benchmark(instructions=5000000):
+    # Millions of instructions and cycles per second on the benchmark program
+    assembler = t34Assembler(batch=True, listing=None)
+    assembler.source = BENCHMARK.splitlines(True)
+    simulator = t34Simulator(assembler.assemble().image)
+    start = time.perf_counter()
+    simulator.run(instructions)
+    elapsed = time.perf_counter() - start
+    return simulator.instructions / elapsed / 1e6, simulator.cycles / elapsed / 1e6
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="T34 simulator")
+    parser.add_argument("path", nargs="?", help="source to assemble and run, or an object file")
+    parser.add_argument("--start", help="address or label to start at, the first record by default")
+    parser.add_argument("--max", type=int, default=None, help="most instructions to run")
+    parser.add_argument("--break", dest="breakpoints", action="append", default=[], help="address or label to stop at, repeatable")
+    parser.add_argument("--interrupts", action="store_true", help="take BRK through the interrupt vector instead of stopping")
+    parser.add_argument("--benchmark", type=int, metavar="INSTRUCTIONS", help="run the benchmark program and report MIPS")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        mips, cycles = benchmark(args.benchmark)
+        print(f"{args.benchmark} instructions, {mips:.2f} MIPS, {cycles:.2f} M cycles/s")
+        sys.exit(0)
+    if not args.path:
+        parser.error("a path or --benchmark is required")
+
+    # Sources are assembled first so their labels can be used as addresses
+    simulator = t34Simulator(stopOnBrk=not args.interrupts)
+    symbols = {}
+    if args.path.endswith(".o"):
+        simulator.load_object(args.path)
+    else:
+        assembler = t34Assembler(batch=True, listing=None)
+        if not assembler.fopen(args.path):
+            print(f"Unable to open {args.path}.")
+            sys.exit(1)
+        assembler.fread()
+        assembler.fclose()
+        result = assembler.assemble()
+        for diagnostic in result.diagnostics:
+            print(diagnostic)
+        if result.errors:
+            sys.exit(1)
+        simulator.load(result.image)
+        symbols = result.symbols
+
+    def address(text):
+        return symbols[text] if text in symbols else int(text.lstrip("$"), 16)
+    if args.start:
+        simulator.reset(address(args.start))
+    simulator.breakpoints.update(address(text) for text in args.breakpoints)
+
+    start = time.perf_counter()
+    reason = simulator.run(args.max)
+    elapsed = time.perf_counter() - start
+    print(f"Stopped on {reason} at {simulator.pc:04X}")
+    print(simulator)
+    print(f"{elapsed * 1000:.1f} ms, {simulator.instructions / elapsed / 1e6 if elapsed else 0:.2f} MIPS")